@@ -0,0 +1,217 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+
+_STOP = object()  # sentinel telling the writer thread to drain and exit
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class AuditLog:
+    """Append-only log of answered queries, written to SQLite in the background.
+
+    record() only puts the entry on a bounded in-memory queue; a writer thread
+    drains it in batches. When the queue is full record() blocks until the
+    writer catches up, so entries are never dropped. Batches that fail to
+    write are kept and retried, up to max_queue_size entries; while that many
+    are waiting the writer stops draining the queue, so record() blocks as it
+    would for a full queue. Entries still unwritten at shutdown are spilled to
+    a JSON-lines file next to the database.
+    """
+
+    def __init__(
+        self, db_path, max_queue_size=10000, batch_size=200, flush_interval=1.0
+    ):
+        self.db_path = db_path
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closing = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._written = 0
+        self._batches = 0
+        self._backpressure_waits = 0
+        self._write_errors = 0
+        self._spilled = 0
+        self._unwritten = []  # entries from failed batches, retried first
+        self._unwritten_count = 0
+        self.spill_path = f"{db_path}.unwritten.jsonl"
+        # Recent samples for the overhead report
+        self._record_ms = deque(maxlen=10000)
+        self._query_ms = deque(maxlen=10000)
+
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS audit_log ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "timestamp REAL NOT NULL, "
+            "question TEXT NOT NULL, "
+            "chunk_ids TEXT NOT NULL, "
+            "answer TEXT NOT NULL, "
+            "latency_ms REAL)"
+        )
+        conn.commit()
+        conn.close()
+
+        self._writer = threading.Thread(
+            target=self._run, name="audit-log-writer", daemon=True
+        )
+        self._writer.start()
+
+    def record(self, question, chunk_ids, answer, latency_ms=None):
+        """Queues an entry for writing."""
+        started = time.perf_counter()
+        entry = (time.time(), question, json.dumps(chunk_ids), answer, latency_ms)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._stats_lock:
+                self._backpressure_waits += 1
+            self._queue.put(entry)
+        with self._stats_lock:
+            self._record_ms.append((time.perf_counter() - started) * 1000)
+            if latency_ms is not None:
+                self._query_ms.append(latency_ms)
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        stopping = False
+        while not stopping:
+            room = self.max_queue_size - len(self._unwritten)
+            if room <= 0 and not self._closing.is_set():
+                # Writes keep failing and the retry buffer is full: leave the
+                # queue alone so record() blocks instead of buffering forever
+                self._closing.wait(self.flush_interval)
+                self._flush(conn, [])
+                continue
+            try:
+                entry = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._closing.is_set():
+                    # close() could not queue _STOP behind a stalled writer
+                    entry = _STOP
+                else:
+                    if self._unwritten:
+                        self._flush(conn, [])
+                    continue
+            batch = []
+            while True:
+                if entry is _STOP or self._closing.is_set():
+                    stopping = True
+                if entry is not _STOP:
+                    batch.append(entry)
+                if stopping or len(batch) >= min(self.batch_size, room):
+                    break
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if stopping:
+                # drain whatever was queued before close()
+                while True:
+                    try:
+                        entry = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if entry is not _STOP:
+                        batch.append(entry)
+            if batch or self._unwritten:
+                self._flush(conn, batch)
+        if self._unwritten:
+            self._spill(self._unwritten)
+            self._unwritten = []
+        conn.close()
+
+    def _flush(self, conn, batch):
+        """Writes previously failed entries plus batch, keeping them on failure."""
+        batch = self._unwritten + batch
+        if self._write_batch(conn, batch):
+            self._unwritten = []
+        else:
+            self._unwritten = batch
+        with self._stats_lock:
+            self._unwritten_count = len(self._unwritten)
+
+    def _write_batch(self, conn, batch, attempts=3):
+        for attempt in range(1, attempts + 1):
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO audit_log "
+                        "(timestamp, question, chunk_ids, answer, latency_ms) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        batch,
+                    )
+                break
+            except sqlite3.Error as e:
+                print(f"Error writing {len(batch)} audit log entries: {e}")
+                with self._stats_lock:
+                    self._write_errors += 1
+                if attempt == attempts:
+                    return False
+                time.sleep(0.1 * attempt)
+        with self._stats_lock:
+            self._written += len(batch)
+            self._batches += 1
+        return True
+
+    def _spill(self, entries):
+        """Last resort at shutdown: appends unwritten entries to a JSON-lines file."""
+        keys = ("timestamp", "question", "chunk_ids", "answer", "latency_ms")
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(dict(zip(keys, entry))) + "\n")
+        except OSError as e:
+            print(f"Error spilling {len(entries)} audit log entries: {e}")
+            return
+        print(f"Spilled {len(entries)} unwritten audit entries to {self.spill_path}")
+        with self._stats_lock:
+            self._spilled += len(entries)
+
+    def close(self, timeout=30.0):
+        """Flushes every queued entry and stops the writer thread."""
+        if not self._writer.is_alive():
+            return
+        self._closing.set()
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass  # the writer drains the queue and stops once it sees _closing
+        self._writer.join(timeout)
+        if self._writer.is_alive():
+            print(f"Audit log writer did not finish within {timeout}s.")
+
+    def stats(self):
+        """Reports queue depth, throughput and the overhead record() adds to queries."""
+        with self._stats_lock:
+            record_ms = list(self._record_ms)
+            query_ms = list(self._query_ms)
+            stats = {
+                "pending": self._queue.qsize(),
+                "written": self._written,
+                "batches": self._batches,
+                "backpressure_waits": self._backpressure_waits,
+                "write_errors": self._write_errors,
+                "unwritten": self._unwritten_count,
+                "spilled": self._spilled,
+            }
+        stats["record_overhead_ms"] = {
+            "p50": _percentile(record_ms, 50),
+            "p99": _percentile(record_ms, 99),
+        }
+        stats["query_latency_ms"] = {
+            "p50": _percentile(query_ms, 50),
+            "p99": _percentile(query_ms, 99),
+        }
+        return stats
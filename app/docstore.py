@@ -0,0 +1,97 @@
+import json
+import sqlite3
+import threading
+
+from langchain_core.documents import Document
+from langchain_core.stores import BaseStore
+
+# SQLite limits the number of bound parameters per statement
+_MAX_SQL_VARIABLES = 500
+
+
+class SQLiteDocStore(BaseStore[str, Document]):
+    """Key-value store of documents backed by a single SQLite file."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # The connection is shared between the request handlers and background tasks
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def mget(self, keys):
+        """Returns the documents for keys, with None for missing keys."""
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _MAX_SQL_VARIABLES):
+                batch = keys[i : i + _MAX_SQL_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT id, page_content, metadata FROM documents "
+                    f"WHERE id IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for doc_id, page_content, metadata in rows:
+                    found[doc_id] = Document(
+                        page_content=page_content, metadata=json.loads(metadata)
+                    )
+        return [found.get(key) for key in keys]
+
+    def mset(self, key_value_pairs):
+        """Inserts or replaces documents."""
+        rows = [
+            (key, doc.page_content, json.dumps(doc.metadata))
+            for key, doc in key_value_pairs
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (id, page_content, metadata) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def mdelete(self, keys):
+        """Deletes documents by key. Missing keys are ignored."""
+        keys = list(keys)
+        with self._lock:
+            for i in range(0, len(keys), _MAX_SQL_VARIABLES):
+                batch = keys[i : i + _MAX_SQL_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                self._conn.execute(
+                    f"DELETE FROM documents WHERE id IN ({placeholders})", batch
+                )
+            self._conn.commit()
+
+    def yield_keys(self, prefix=None):
+        """Yields stored keys, optionally only those starting with prefix."""
+        with self._lock:
+            if prefix is None:
+                rows = self._conn.execute("SELECT id FROM documents").fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT id FROM documents WHERE substr(id, 1, ?) = ?",
+                    (len(prefix), prefix),
+                ).fetchall()
+        for (doc_id,) in rows:
+            yield doc_id
+
+    def count(self):
+        """Returns the number of stored documents."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def vacuum(self):
+        """Reclaims free pages left behind by deletions."""
+        with self._lock:
+            self._conn.execute("VACUUM")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
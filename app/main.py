@@ -1,7 +1,8 @@
 import os
 import shutil
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, BackgroundTasks
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
 import uvicorn
@@ -9,7 +10,26 @@ import uvicorn
 from typing import Optional, List
 
 # import the rag logic
-from app.rag_processor import add_document_to_store, query_documnents, get_vector_store
+from app.rag_processor import (
+    add_document_to_store,
+    query_documnents,
+    get_vector_store,
+    backfill_manifest,
+    list_documents,
+    delete_document,
+    needs_compaction,
+    compact_vector_store,
+    get_index_stats,
+    get_last_compaction_report,
+    drop_retired_collections,
+    get_audit_log,
+    close_audit_log,
+    get_pdf_extraction_stats,
+    close_pdf_extraction,
+    start_embedding_migration,
+    stop_embedding_migration,
+    get_embedding_status,
+)
 
 # directory for uploads
 UPLOAD_DIR = "temp_uploads"
@@ -22,10 +42,20 @@ async def lifespan(app: FastAPI):
     try:
         get_vector_store()
         print("Vector store initialized successfully on startup.")
-        yield
+        backfill_manifest()
+        # Nothing can still be reading collections retired before a restart
+        drop_retired_collections(min_age=0)
+        if start_embedding_migration():
+            print("Embedding model changed; re-embedding in the background.")
     except Exception as e:
         print(f"Error initializing vector store on startup: {e}")
-        yield  # still yield to let the app continue (optional)
+        # still continue to let the app start (optional)
+    get_audit_log()
+    yield
+    print("Application shutdown: flushing audit log...")
+    stop_embedding_migration()
+    close_audit_log()
+    close_pdf_extraction()
 
 
 # Initialize FastAPI app
@@ -53,11 +83,28 @@ class QueryResponse(BaseModel):
     source_documents: Optional[list[SourceDocument]] = None
 
 
+class DocumentInfo(BaseModel):
+    source: str
+    filename: str
+    chunk_count: int
+    parent_count: int
+    token_count: int
+    added_at: float
+
+
+class DeleteDocumentResponse(BaseModel):
+    filename: str
+    deleted_chunks: int
+    compaction_scheduled: bool = False
+
+
 # API Endpoints
 
 
 @app.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
+async def upload_document(
+    background_tasks: BackgroundTasks, file: UploadFile = File(...)
+):
     """Handles document uploads, processing, and ingestion into the vector store."""
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file provided.")
@@ -81,11 +128,17 @@ async def upload_document(file: UploadFile = File(...)):
 
         # process and add document to vector store
         print(f"Adding document {file.filename} to vector store...")
-        processing_success = add_document_to_store(temp_file_path)
+        # Run in the threadpool so queries are not blocked while the index is busy
+        processing_success = await run_in_threadpool(
+            add_document_to_store, temp_file_path
+        )
 
         # --- Immediate Simple Return ---
         if processing_success:
             print("Processing reported success. Returning standard JSONResponse.")
+            # Re-uploads replace the previous version and can fragment the index
+            if needs_compaction():
+                background_tasks.add_task(compact_vector_store)
             # Return the absolute simplest response possible
             return JSONResponse(
                 status_code=200,
@@ -134,7 +187,9 @@ async def query_agent(request: QueryRequest):
 
     try:
         print(f"Handling query via API: '{request.query}'")
-        result = query_documnents(request.query)
+        # Run in the threadpool: retrieval, query expansion and the LLM call all
+        # block, and would otherwise serialize every request on the event loop
+        result = await run_in_threadpool(query_documnents, request.query)
         # The query_documents function now returns a dict matching QueryResponse structure
         return QueryResponse(**result)
     except Exception as e:
@@ -148,6 +203,68 @@ async def query_agent(request: QueryRequest):
         raise HTTPException(status_code=500, detail=f"Failed to process query: {e}")
 
 
+@app.get("/documents", response_model=list[DocumentInfo])
+async def get_documents():
+    """Lists the documents currently in the vector store."""
+    return list_documents()
+
+
+@app.delete("/documents/{filename}", response_model=DeleteDocumentResponse)
+async def remove_document(filename: str, background_tasks: BackgroundTasks):
+    """Removes a document from the index, compacting it in the background if needed."""
+    try:
+        result = await run_in_threadpool(delete_document, filename)
+    except Exception as e:
+        print(f"Error deleting document {filename}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to delete document: {e}")
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Document '{filename}' not found.")
+
+    if needs_compaction():
+        background_tasks.add_task(compact_vector_store)
+        result["compaction_scheduled"] = True
+    return DeleteDocumentResponse(**result)
+
+
+@app.post("/documents/compact", status_code=202)
+async def compact_index(background_tasks: BackgroundTasks):
+    """Schedules a rebuild of the vector index without deleted entries."""
+    background_tasks.add_task(compact_vector_store)
+    index = await run_in_threadpool(get_index_stats)
+    return {"message": "Index compaction scheduled.", "index": index}
+
+
+@app.get("/documents/stats")
+async def index_stats():
+    """Reports index size and fragmentation, and the last compaction's before/after."""
+    # Walks chroma_db and opens SQLite, so keep it off the event loop
+    index = await run_in_threadpool(get_index_stats)
+    return {
+        "index": index,
+        "last_compaction": get_last_compaction_report(),
+        "pdf_extraction": get_pdf_extraction_stats(),
+    }
+
+
+@app.get("/audit/stats")
+async def audit_stats():
+    """Reports audit log queue depth and the overhead it adds to query latency."""
+    return get_audit_log().stats()
+
+
+@app.get("/embeddings/status")
+async def embedding_status():
+    """Reports the active and configured embedding models and migration progress."""
+    return get_embedding_status()
+
+
+@app.post("/embeddings/migrate", status_code=202)
+async def migrate_embedding_model():
+    """Starts re-embedding into the configured model if it is not active yet."""
+    started = start_embedding_migration()
+    return {"migration_started": started, **get_embedding_status()}
+
+
 # --- Run the API (for local development) ---
 if __name__ == "__main__":
     print("Starting FastAPI server...")
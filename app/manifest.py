@@ -0,0 +1,130 @@
+import sqlite3
+import threading
+import time
+
+
+class DocumentManifest:
+    """SQLite record of ingested documents and the vector store IDs they own.
+
+    Also keeps a few index settings (e.g. the active collection name) that must
+    survive restarts.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                source TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                parent_count INTEGER NOT NULL,
+                token_count INTEGER NOT NULL,
+                added_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS documents_filename ON documents (filename);
+            CREATE TABLE IF NOT EXISTS entries (
+                id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                kind TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_source ON entries (source);
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def add_document(self, source, filename, chunk_ids, parent_ids=(), token_count=0):
+        """Records a document, replacing any previous record for the same source."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE source = ?", (source,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents "
+                "(source, filename, chunk_count, parent_count, token_count, added_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    source,
+                    filename,
+                    len(chunk_ids),
+                    len(parent_ids),
+                    token_count,
+                    time.time(),
+                ),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (id, source, kind) VALUES (?, ?, ?)",
+                [(i, source, "chunk") for i in chunk_ids]
+                + [(i, source, "parent") for i in parent_ids],
+            )
+
+    def remove_document(self, source):
+        """Forgets a document and its entries."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE source = ?", (source,))
+            self._conn.execute("DELETE FROM documents WHERE source = ?", (source,))
+
+    def get_entry_ids(self, source, kind):
+        """Returns the IDs of the given kind ("chunk" or "parent") for a source."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM entries WHERE source = ? AND kind = ?", (source, kind)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def find_sources(self, filename):
+        """Returns the sources recorded under a filename."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source FROM documents WHERE filename = ?", (filename,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def list_documents(self):
+        """Returns one dict per document, most recently added first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, filename, chunk_count, parent_count, token_count, "
+                "added_at FROM documents ORDER BY added_at DESC"
+            ).fetchall()
+        keys = (
+            "source",
+            "filename",
+            "chunk_count",
+            "parent_count",
+            "token_count",
+            "added_at",
+        )
+        return [dict(zip(keys, row)) for row in rows]
+
+    def count_documents(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def get_setting(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM settings WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else default
+
+    def set_setting(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                (key, str(value)),
+            )
+
+    def vacuum(self):
+        """Reclaims free pages left behind by deletions."""
+        with self._lock:
+            self._conn.execute("VACUUM")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,168 @@
+import glob
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Kept free of LangChain/model imports: process pool workers import this module.
+
+PDF_BACKENDS = ("pypdf", "pymupdf")
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _open_pymupdf(file_path):
+    try:
+        import pymupdf
+    except ImportError:
+        raise ValueError(
+            "The 'pymupdf' PDF backend requires PyMuPDF (pip install pymupdf)."
+        )
+    return pymupdf.open(file_path)
+
+
+def count_pages(file_path, backend="pypdf"):
+    """Returns the number of pages in a PDF."""
+    if backend == "pypdf":
+        from pypdf import PdfReader
+
+        return len(PdfReader(file_path).pages)
+    if backend == "pymupdf":
+        with _open_pymupdf(file_path) as pdf:
+            return pdf.page_count
+    raise ValueError(f"Unknown PDF backend: {backend}. Choose from {PDF_BACKENDS}")
+
+
+def extract_page_range(file_path, backend, start, end):
+    """Extracts the text of pages [start, end). Runs inside pool workers."""
+    if backend == "pypdf":
+        from pypdf import PdfReader
+
+        reader = PdfReader(file_path)
+        return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+    if backend == "pymupdf":
+        with _open_pymupdf(file_path) as pdf:
+            return [pdf[i].get_text() for i in range(start, end)]
+    raise ValueError(f"Unknown PDF backend: {backend}. Choose from {PDF_BACKENDS}")
+
+
+def page_ranges(page_count, parts):
+    """Splits page_count pages into at most `parts` contiguous (start, end) ranges."""
+    parts = max(1, min(parts, page_count))
+    size, extra = divmod(page_count, parts)
+    ranges = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _get_process_pool(max_workers):
+    """Returns the pool shared by every upload, created on first use.
+
+    Workers are spawned rather than forked: forking the server process would
+    copy its threads' locks and the loaded models into every worker.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+def shutdown_process_pool():
+    """Stops the worker processes, if any were started."""
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def extract_pdf_pages(file_path, backend="pypdf", max_workers=None, min_pages=32):
+    """Returns the text of every page, using a process pool for large PDFs.
+
+    The pool has max_workers processes and is shared, so concurrent uploads
+    queue for the same workers instead of each starting their own.
+    """
+    page_count = count_pages(file_path, backend)
+    max_workers = max_workers or os.cpu_count() or 1
+    if page_count < min_pages or max_workers < 2:
+        return extract_page_range(file_path, backend, 0, page_count)
+
+    ranges = page_ranges(page_count, max_workers)
+    try:
+        results = _get_process_pool(max_workers).map(
+            extract_page_range,
+            [file_path] * len(ranges),
+            [backend] * len(ranges),
+            [start for start, _ in ranges],
+            [end for _, end in ranges],
+        )
+        return [text for texts in results for text in texts]
+    except BrokenProcessPool as e:
+        # A worker died (e.g. killed for memory); start a fresh pool next time
+        print(f"PDF worker pool failed ({e}); parsing {file_path} in-process.")
+        shutdown_process_pool()
+        return extract_page_range(file_path, backend, 0, page_count)
+
+
+# --- Parse cache ---
+
+
+def file_content_hash(file_path):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_path(cache_dir, key):
+    return os.path.join(cache_dir, f"{key}.json.gz")
+
+
+def remove_cached_pages(cache_dir, content_hash):
+    """Deletes the cache entries of a file for every backend. Returns the count."""
+    removed = 0
+    for path in glob.glob(_cache_path(cache_dir, f"{content_hash}-*")):
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            print(f"Error removing parse cache entry {path}: {e}")
+    return removed
+
+
+def load_cached_pages(cache_dir, key):
+    """Returns cached page texts for key, or None on a miss."""
+    path = _cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)["pages"]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable parse cache entry {path}: {e}")
+        return None
+
+
+def save_cached_pages(cache_dir, key, pages):
+    """Stores page texts under key, atomically so readers never see partial files."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(cache_dir, key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump({"pages": pages}, f)
+    os.replace(tmp_path, path)
@@ -1,11 +1,18 @@
 import os
 import sentence_transformers
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+import tiktoken
+from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+from langchain_core.documents import Document
+
 # Import LCEL components
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from langchain_core.runnables import (
+    RunnablePassthrough,
+    RunnableLambda,
+    RunnableParallel,
+)
 from langchain_core.output_parsers import StrOutputParser
 
 from langchain_huggingface import HuggingFaceEmbeddings
@@ -15,7 +22,28 @@ from dotenv import load_dotenv
 
 from langchain_openai import AzureChatOpenAI
 
+import json
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+import time
 import traceback
+import uuid
+
+from app.audit_log import AuditLog
+from app.docstore import SQLiteDocStore
+from app.manifest import DocumentManifest
+from app.pdf_extraction import (
+    extract_pdf_pages,
+    file_content_hash,
+    load_cached_pages,
+    remove_cached_pages,
+    save_cached_pages,
+    shutdown_process_pool,
+)
 
 # Load environment variables
 load_dotenv()
@@ -34,7 +62,103 @@ if not all([azure_endpoint, azure_key, azure_deployment_name]):
 # Constants
 CHROMA_DB_DIR = "chroma_db"
 COLLECTION_NAME = "docuagent_collection"
-EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# Model that stores created before model versioning were embedded with
+DEFAULT_EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# Model new vectors should use. When it differs from the model of the active
+# collection, existing chunks are re-embedded by a background migration.
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", DEFAULT_EMBEDDING_MODEL_NAME)
+
+# --- Chunking Configuration ---
+# "character": fixed-size character chunks (original behaviour)
+# "token": token-length aware chunks that prefer structural boundaries
+SPLITTER_MODE = os.getenv("SPLITTER_MODE", "character")
+CHAR_CHUNK_SIZE = 1000
+CHAR_CHUNK_OVERLAP = 150
+# Token mode measures chunks with the embedding model's own tokenizer. The
+# default size is the model's max sequence length minus [CLS]/[SEP], so no
+# chunk is silently truncated at embedding time (254 for all-MiniLM-L6-v2).
+TOKEN_CHUNK_SIZE = None
+TOKEN_CHUNK_OVERLAP = 32
+# Only used for the token_count metadata (LLM context budgeting)
+TOKEN_ENCODING_NAME = "o200k_base"  # tokenizer used by GPT-4o
+# Tried in order: form feeds (page breaks in .txt exports), markdown headings,
+# numbered section headings, paragraphs, lines, sentences, words.
+STRUCTURE_SEPARATORS = [
+    r"\f",
+    r"\n(?=#{1,6} )",
+    r"\n(?=\d+(?:\.\d+)*\.? +[A-Z])",
+    r"\n\s*\n",
+    r"\n",
+    r"(?<=[.!?]) +",
+    r" ",
+    r"",
+]
+
+# --- PDF Extraction Configuration ---
+PDF_BACKEND = os.getenv("PDF_BACKEND", "pypdf")  # "pypdf" or "pymupdf"
+PDF_PARALLEL_MIN_PAGES = 32  # smaller PDFs are parsed in-process
+# Size of the worker pool shared by all uploads
+PDF_MAX_WORKERS = int(os.getenv("PDF_MAX_WORKERS", os.cpu_count() or 1))
+# Extracted page text keyed by file content hash and backend. Entries are
+# removed when their document is deleted or replaced by different content.
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", "parse_cache")
+
+# --- Retrieval Configuration ---
+# "chunk": the indexed chunk is also the context passed to the LLM
+# "parent": small child chunks are indexed and their larger parent sections,
+#           kept in a local docstore, are passed to the LLM
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "chunk")
+# Kept inside CHROMA_DB_DIR so it is persisted by the same volume mount
+DOCSTORE_PATH = os.path.join(CHROMA_DB_DIR, "parent_docstore.sqlite3")
+# (chunk_size, chunk_overlap) per splitter mode
+PARENT_CHUNK_SIZES = {"character": (4000, 0), "token": (1024, 0)}
+CHILD_CHUNK_SIZES = {"character": (400, 50), "token": (96, 16)}
+CHILD_SEARCH_K = 8  # child chunks fetched per query
+PARENT_TOP_K = 4  # distinct parents passed to the LLM
+
+# --- Query Expansion Configuration ---
+# Comma-separated expansions to search alongside the original question:
+# "multi_query" (LLM paraphrases) and/or "hyde" (a hypothetical answer passage).
+QUERY_EXPANSION = [
+    kind.strip() for kind in os.getenv("QUERY_EXPANSION", "").split(",") if kind.strip()
+]
+MULTI_QUERY_COUNT = 3
+# Expansions not generated within this budget are skipped for the current query
+EXPANSION_TIMEOUT_SECONDS = float(os.getenv("EXPANSION_TIMEOUT_SECONDS", "2.0"))
+EXPANSION_CACHE_SIZE = 256
+RETRIEVAL_K = 4  # chunks passed to the LLM in "chunk" mode
+RRF_K = 60  # reciprocal rank fusion constant used to merge expanded searches
+
+MULTI_QUERY_TEMPLATE = """Write {count} different rephrasings of the question below \
+that could help find relevant passages in a document search.
+Return one rephrasing per line with no numbering or extra text.
+Question: {question}"""
+HYDE_TEMPLATE = """Write a short passage (3-4 sentences) that could plausibly answer \
+the question below, as if taken from a relevant document.
+Question: {question}
+Passage:"""
+
+# --- Index Maintenance Configuration ---
+MANIFEST_PATH = os.path.join(CHROMA_DB_DIR, "manifest.sqlite3")
+# Compact once this share of the index has been deleted...
+COMPACTION_FRAGMENTATION_THRESHOLD = 0.25
+# ...and at least this many chunks were removed since the last compaction
+COMPACTION_MIN_DELETED = 500
+STORE_BATCH_SIZE = 1000  # ids per Chroma get/add/delete call
+# Collections replaced by a swap are dropped after this long, so queries that
+# already hold the old collection can finish
+COLLECTION_DROP_GRACE_SECONDS = 300
+
+# --- Embedding Migration Configuration ---
+MIGRATION_BATCH_SIZE = 32  # chunks re-embedded per step
+# Caps re-embedding throughput so query embeddings are not starved of CPU.
+# 0 or less disables the cap.
+MIGRATION_MAX_CHUNKS_PER_SECOND = float(
+    os.getenv("MIGRATION_MAX_CHUNKS_PER_SECOND", "50")
+)
+
+# --- Audit Log Configuration ---
+AUDIT_LOG_PATH = os.getenv("AUDIT_LOG_PATH", os.path.join("audit", "audit_log.sqlite3"))
 
 # check if llm key exists
 if os.getenv("OPENAI_API_KEY") is None:
@@ -42,21 +166,107 @@ if os.getenv("OPENAI_API_KEY") is None:
 
 
 # --- Singleton Instances (manage resources efficiently) ---
-_embedding_function = None
+_embedding_functions = {}  # one per model name
 _vector_store = None
 _rag_chain = None
+_token_encoding = None
+_token_encoding_failed = False
+_docstore = None
+_manifest = None
+_last_compaction_report = None
+_audit_log = None
+_llm = None
+_search_executor = None
+_expansion_executor = None
+_expansion_cache = OrderedDict()
+_expansion_cache_lock = threading.Lock()
+_pdf_extraction_stats = {"cache_hits": 0, "backends": {}}
+_pdf_extraction_stats_lock = threading.Lock()
+
+# Serializes writes to the index (ingest, delete, compaction swap)
+_index_lock = threading.RLock()
+# Held by compaction and embedding migration, which both swap collections
+_maintenance_lock = threading.Lock()
+_migration_stop = threading.Event()
+_migration_status = {"state": "idle"}
+
 
+def get_embedding_function(model_name=None):
+    """Initialize and return singleton embedding function
 
-def get_embedding_function():
-    """Initialize and return singleton embedding function"""
-    global _embedding_function
-    if _embedding_function is None:
-        print(f"Initializing embedding model: {EMBEDDING_MODEL_NAME}")
-        _embedding_function = HuggingFaceEmbeddings(
-            model_name=EMBEDDING_MODEL_NAME, model_kwargs={"device": "cpu"}
+    Defaults to the model of the active collection, which is what queries
+    must be embedded with.
+    """
+    model_name = model_name or get_active_embedding_model()
+    if model_name not in _embedding_functions:
+        print(f"Initializing embedding model: {model_name}")
+        _embedding_functions[model_name] = HuggingFaceEmbeddings(
+            model_name=model_name, model_kwargs={"device": "cpu"}
         )
         print("Embedding model initialized.")
-    return _embedding_function
+    return _embedding_functions[model_name]
+
+
+def get_token_encoding():
+    """Initialize and return singleton tiktoken encoding used for chunk statistics
+
+    Returns None if the encoding cannot be loaded (tiktoken downloads it on
+    first use unless TIKTOKEN_CACHE_DIR holds a copy).
+    """
+    global _token_encoding, _token_encoding_failed
+    if _token_encoding is None and not _token_encoding_failed:
+        try:
+            _token_encoding = tiktoken.get_encoding(TOKEN_ENCODING_NAME)
+        except Exception as e:
+            _token_encoding_failed = True
+            print(f"Warning: tiktoken encoding unavailable, skipping token_count: {e}")
+    return _token_encoding
+
+
+def count_tokens(text):
+    """Returns the number of LLM tokens in text, or None if tiktoken is unavailable."""
+    encoding = get_token_encoding()
+    if encoding is None:
+        return None
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_embedding_tokens(text):
+    """Returns the number of embedding-model tokens in text, without special tokens."""
+    tokenizer = get_embedding_function().client.tokenizer
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def get_max_embedding_tokens():
+    """Returns how many content tokens the embedding model embeds without truncation."""
+    # [CLS] and [SEP] take two positions of the model's max sequence length
+    return get_embedding_function().client.max_seq_length - 2
+
+
+def get_manifest():
+    """Initializes and returns a singleton document manifest."""
+    global _manifest
+    if _manifest is None:
+        os.makedirs(CHROMA_DB_DIR, exist_ok=True)
+        _manifest = DocumentManifest(MANIFEST_PATH)
+    return _manifest
+
+
+def get_active_embedding_model():
+    """Returns the model that produced the vectors in the active collection."""
+    return get_manifest().get_setting(
+        "active_embedding_model", DEFAULT_EMBEDDING_MODEL_NAME
+    )
+
+
+def _open_collection(collection_name, model_name):
+    """Opens (or creates) a Chroma collection tagged with its embedding model."""
+    return Chroma(
+        persist_directory=CHROMA_DB_DIR,
+        embedding_function=get_embedding_function(model_name),
+        collection_name=collection_name,
+        collection_metadata={"embedding_model": model_name},
+    )
 
 
 def get_vector_store():
@@ -65,13 +275,23 @@ def get_vector_store():
     if _vector_store is None:
         print(f"Accessing ChromaDB persistence directory: {CHROMA_DB_DIR}")
         os.makedirs(CHROMA_DB_DIR, exist_ok=True)  # Ensure directory exists
-        embedding_function = get_embedding_function()
-        _vector_store = Chroma(
-            persist_directory=CHROMA_DB_DIR,
-            embedding_function=embedding_function,
-            collection_name=COLLECTION_NAME,
+        # Compaction and migration swap in a rebuilt collection under a new name
+        manifest = get_manifest()
+        collection_name = manifest.get_setting("active_collection", COLLECTION_NAME)
+        model_name = manifest.get_setting("active_embedding_model")
+        if model_name is None:
+            # Existing stores predate model versioning and used the default
+            # model; a brand-new store starts on the configured one.
+            is_new = not os.path.exists(os.path.join(CHROMA_DB_DIR, "chroma.sqlite3"))
+            model_name = (
+                EMBEDDING_MODEL_NAME if is_new else DEFAULT_EMBEDDING_MODEL_NAME
+            )
+            manifest.set_setting("active_embedding_model", model_name)
+        _vector_store = _open_collection(collection_name, model_name)
+        print(
+            f"Vector store collection '{collection_name}' accessed/created "
+            f"(embedding model: {model_name})."
         )
-        print(f"Vector store collection '{COLLECTION_NAME}' accessed/created.")
         try:
             print(f"Initial vector store count: {_vector_store._collection.count()}")
         except Exception as e:
@@ -79,6 +299,240 @@ def get_vector_store():
     return _vector_store
 
 
+def get_docstore():
+    """Initializes and returns a singleton parent document store."""
+    global _docstore
+    if _docstore is None:
+        os.makedirs(CHROMA_DB_DIR, exist_ok=True)
+        _docstore = SQLiteDocStore(DOCSTORE_PATH)
+        print(f"Parent docstore opened: {DOCSTORE_PATH} ({_docstore.count()} parents)")
+    return _docstore
+
+
+def retrieve_parent_documents(query_text):
+    """Searches child chunks and returns their de-duplicated parent sections.
+
+    Chunks ingested in "chunk" mode have no parent and are returned as-is.
+    """
+    children = search_chunks(query_text, CHILD_SEARCH_K)
+    parent_ids = [c.metadata.get("parent_id") for c in children]
+    parent_ids = list(dict.fromkeys(i for i in parent_ids if i))
+    stored = dict(zip(parent_ids, get_docstore().mget(parent_ids)))
+
+    parents = []
+    seen = set()
+    for child in children:
+        parent_id = child.metadata.get("parent_id")
+        if parent_id is None:
+            parents.append(child)
+        elif parent_id not in seen:
+            seen.add(parent_id)
+            if stored[parent_id] is not None:
+                parents.append(stored[parent_id])
+        if len(parents) == PARENT_TOP_K:
+            break
+    return parents
+
+
+def get_retriever():
+    """Returns the retriever for the configured RETRIEVAL_MODE."""
+    if RETRIEVAL_MODE == "parent":
+        return RunnableLambda(retrieve_parent_documents)
+    if QUERY_EXPANSION:
+        return RunnableLambda(lambda query_text: search_chunks(query_text, RETRIEVAL_K))
+    return get_vector_store().as_retriever(search_kwargs={"k": RETRIEVAL_K})
+
+
+# Query Expansion
+def _get_search_executor():
+    global _search_executor
+    if _search_executor is None:
+        _search_executor = ThreadPoolExecutor(
+            max_workers=MULTI_QUERY_COUNT + 2, thread_name_prefix="vector-search"
+        )
+    return _search_executor
+
+
+def _get_expansion_executor():
+    # Separate from the search pool so slow LLM calls that overrun the
+    # latency budget cannot starve searches.
+    global _expansion_executor
+    if _expansion_executor is None:
+        _expansion_executor = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="query-expansion"
+        )
+    return _expansion_executor
+
+
+def _generate_expansions(kind, query_text):
+    """Asks the LLM for expansions of one kind ("multi_query" or "hyde")."""
+    if kind == "multi_query":
+        prompt = ChatPromptTemplate.from_template(MULTI_QUERY_TEMPLATE)
+        text = (prompt | get_llm() | StrOutputParser()).invoke(
+            {"question": query_text, "count": MULTI_QUERY_COUNT}
+        )
+        # Strip any list markers the model adds despite the instructions
+        lines = [
+            re.sub(r"^\s*(?:[-*]|\d+[.)])\s*", "", line).strip()
+            for line in text.split("\n")
+        ]
+        return [line for line in lines if line][:MULTI_QUERY_COUNT]
+    if kind == "hyde":
+        prompt = ChatPromptTemplate.from_template(HYDE_TEMPLATE)
+        passage = (prompt | get_llm() | StrOutputParser()).invoke(
+            {"question": query_text}
+        )
+        return [passage.strip()] if passage.strip() else []
+    raise ValueError(f"Unknown query expansion: {kind}")
+
+
+def _cache_expansions(key, future):
+    """Done-callback that caches successful expansions, even late ones."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    with _expansion_cache_lock:
+        _expansion_cache[key] = future.result()
+        _expansion_cache.move_to_end(key)
+        while len(_expansion_cache) > EXPANSION_CACHE_SIZE:
+            _expansion_cache.popitem(last=False)
+
+
+def expand_query(query_text):
+    """Returns the configured expansions of a question.
+
+    Uncached expansions are generated concurrently; any that miss the
+    EXPANSION_TIMEOUT_SECONDS budget are left out of this query. Those already
+    running are still cached for the next one when they finish; those still
+    queued are cancelled, so a slow LLM cannot build up a backlog that makes
+    every later expansion miss its budget too.
+    """
+    normalized = " ".join(query_text.lower().split())
+    expansions = []
+    pending = {}
+    for kind in QUERY_EXPANSION:
+        key = (kind, normalized)
+        with _expansion_cache_lock:
+            cached = _expansion_cache.get(key)
+            if cached is not None:
+                _expansion_cache.move_to_end(key)
+        if cached is not None:
+            expansions.extend(cached)
+        else:
+            future = _get_expansion_executor().submit(
+                _generate_expansions, kind, query_text
+            )
+            future.add_done_callback(partial(_cache_expansions, key))
+            pending[kind] = future
+
+    if pending:
+        done, not_done = wait(pending.values(), timeout=EXPANSION_TIMEOUT_SECONDS)
+        for kind, future in pending.items():
+            if future in not_done:
+                cancelled = future.cancel()  # only succeeds if it never started
+                print(
+                    f"Query expansion '{kind}' exceeded the latency budget"
+                    f"{' and was cancelled' if cancelled else ''}."
+                )
+            elif future.exception() is not None:
+                print(f"Query expansion '{kind}' failed: {future.exception()}")
+            else:
+                expansions.extend(future.result())
+
+    # Drop expansions that repeat the question or each other
+    unique = []
+    seen = {normalized}
+    for expansion in expansions:
+        key = " ".join(expansion.lower().split())
+        if key not in seen:
+            seen.add(key)
+            unique.append(expansion)
+    return unique
+
+
+def search_chunks(query_text, k):
+    """Searches the vector store for a question and its expansions.
+
+    The question and its expansions are embedded in one batch and all searches
+    run concurrently. Results are merged by reciprocal rank fusion and
+    de-duplicated by chunk ID.
+    """
+    vector_store = get_vector_store()
+    if not QUERY_EXPANSION:
+        return vector_store.similarity_search(query_text, k=k)
+
+    queries = [query_text] + expand_query(query_text)
+    # One forward pass for all of them. HuggingFaceEmbeddings.embed_query is
+    # embed_documents([text])[0], so the question is embedded exactly as on
+    # the non-expansion path.
+    embeddings = vector_store.embeddings.embed_documents(queries)
+    futures = [
+        _get_search_executor().submit(
+            vector_store.similarity_search_by_vector, embedding, k=k
+        )
+        for embedding in embeddings
+    ]
+
+    scores = {}
+    docs_by_id = {}
+    for future in futures:
+        for rank, doc in enumerate(future.result()):
+            doc_id = doc.id or doc.page_content
+            docs_by_id.setdefault(doc_id, doc)
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    print(
+        f"Searched {len(embeddings)} queries, merged into {len(ranked)} unique chunks."
+    )
+    return [docs_by_id[doc_id] for doc_id in ranked[:k]]
+
+
+def get_audit_log():
+    """Initializes and returns the singleton audit log (starts its writer thread)."""
+    global _audit_log
+    if _audit_log is None:
+        audit_dir = os.path.dirname(AUDIT_LOG_PATH)
+        if audit_dir:
+            os.makedirs(audit_dir, exist_ok=True)
+        _audit_log = AuditLog(AUDIT_LOG_PATH)
+        print(f"Audit log writing to {AUDIT_LOG_PATH}")
+    return _audit_log
+
+
+def close_audit_log():
+    """Flushes pending audit entries. Called on application shutdown."""
+    global _audit_log
+    if _audit_log is not None:
+        print(f"Flushing audit log: {_audit_log.stats()['pending']} entries pending")
+        _audit_log.close()
+        _audit_log = None
+
+
+def get_retrieved_ids(docs):
+    """Returns the vector store ID (or parent ID) of each retrieved document."""
+    return [doc.metadata.get("parent_id") or doc.id for doc in docs]
+
+
+def get_llm():
+    """Initializes and returns a singleton Azure OpenAI chat model."""
+    global _llm
+    if _llm is None:
+        if not all([azure_endpoint, azure_key, azure_deployment_name]):
+            raise ValueError("Azure OpenAI environment variables not configured.")
+        try:
+            _llm = AzureChatOpenAI(
+                azure_endpoint=azure_endpoint,
+                api_key=azure_key,
+                azure_deployment=azure_deployment_name,
+                api_version=azure_api_version,
+                temperature=0,
+            )
+            print("AzureChatOpenAI client initialized.")
+        except Exception as e:
+            print(f"Error initializing AzureChatOpenAI: {e}")
+            raise e  # Re-raise the error to be caught by caller
+    return _llm
+
+
 def get_rag_chain():
     """Initializes and returns a singleton LCEL RAG chain."""
     global _rag_chain
@@ -101,22 +555,11 @@ def get_rag_chain():
         prompt = ChatPromptTemplate.from_template(template)
 
         # 2. Get Components
-        try:
-            llm = AzureChatOpenAI(
-                azure_endpoint=azure_endpoint,
-                api_key=azure_key,
-                azure_deployment=azure_deployment_name,
-                api_version=azure_api_version,
-                temperature=0,
-            )
-            print("AzureChatOpenAI client initialized.")
-        except Exception as e:
-            print(f"Error initializing AzureChatOpenAI: {e}")
-            raise e  # Re-raise the error to be caught by caller
+        llm = get_llm()
         vector_store = get_vector_store()
         if vector_store is None:
             raise ValueError("Vector store not initialized. Cannot create RAG chain.")
-        retriever = vector_store.as_retriever()
+        retriever = get_retriever()
 
         # 3 format retrieved documents
         def format_docs(docs):
@@ -140,51 +583,185 @@ def get_rag_chain():
         #    - Pass the context and original question to the prompt.
         #    - Pass the formatted prompt to the LLM.
         #    - Parse the LLM output as a string.
+        #    The retrieved documents are passed through alongside the answer
+        #    so they can be recorded in the audit log.
 
-        _rag_chain = (
+        answer_chain = (
             {
-                "context": retriever | RunnableLambda(log_retrieved_docs) | format_docs,
-                "question": RunnablePassthrough(),
+                "context": RunnableLambda(lambda x: format_docs(x["docs"])),
+                "question": RunnableLambda(lambda x: x["question"]),
             }
             | prompt
             | llm
             | StrOutputParser()
         )
+        _rag_chain = RunnableParallel(
+            docs=retriever | RunnableLambda(log_retrieved_docs),
+            question=RunnablePassthrough(),
+        ).assign(answer=answer_chain)
         print("LCEL RAG chain initialized")
     return _rag_chain
 
 
 # Processing Function
-def load_and_split_document(file_path, chunk_size=1000, chunk_overlap=150):
+def get_text_splitter(splitter_mode=None, chunk_size=None, chunk_overlap=None):
+    """Builds the text splitter for the given mode ("character" or "token")."""
+    splitter_mode = splitter_mode or SPLITTER_MODE
+    if splitter_mode == "character":
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size or CHAR_CHUNK_SIZE,
+            chunk_overlap=(
+                CHAR_CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap
+            ),
+            length_function=len,
+            add_start_index=True,
+        )
+    if splitter_mode == "token":
+        return RecursiveCharacterTextSplitter(
+            separators=STRUCTURE_SEPARATORS,
+            is_separator_regex=True,
+            keep_separator="start",
+            chunk_size=chunk_size or TOKEN_CHUNK_SIZE or get_max_embedding_tokens(),
+            chunk_overlap=(
+                TOKEN_CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap
+            ),
+            length_function=count_embedding_tokens,
+            add_start_index=True,
+            strip_whitespace=True,
+        )
+    raise ValueError(f"Unknown splitter mode: {splitter_mode}")
+
+
+def annotate_chunk_statistics(chunks):
+    """Records token count, position and per-source index in each chunk's metadata.
+
+    Computed once at ingest so later stages can budget context without
+    re-tokenizing retrieved chunks.
+    """
+    chunk_indexes = {}
+    for chunk in chunks:
+        source = chunk.metadata.get("source")
+        chunk_index = chunk_indexes.get(source, 0)
+        chunk_indexes[source] = chunk_index + 1
+
+        start_index = chunk.metadata.get("start_index", -1)
+        chunk.metadata["chunk_index"] = chunk_index
+        token_count = count_tokens(chunk.page_content)
+        if token_count is not None:
+            chunk.metadata["token_count"] = token_count
+        chunk.metadata["char_count"] = len(chunk.page_content)
+        if start_index >= 0:
+            chunk.metadata["end_index"] = start_index + len(chunk.page_content)
+    return chunks
+
+
+def load_pdf_pages(file_path, backend=None):
+    """Loads a PDF as one document per page.
+
+    Page text is cached on disk by file content hash, so re-uploads and
+    re-chunking skip parsing. Large PDFs are parsed across a process pool.
+    """
+    backend = backend or PDF_BACKEND
+    content_hash = file_content_hash(file_path)
+    cache_key = f"{content_hash}-{backend}"
+    pages = load_cached_pages(PARSE_CACHE_DIR, cache_key)
+    if pages is not None:
+        print(f"Parse cache hit for {os.path.basename(file_path)} ({len(pages)} pages)")
+        with _pdf_extraction_stats_lock:
+            _pdf_extraction_stats["cache_hits"] += 1
+    else:
+        started = time.perf_counter()
+        pages = extract_pdf_pages(
+            file_path,
+            backend,
+            max_workers=PDF_MAX_WORKERS,
+            min_pages=PDF_PARALLEL_MIN_PAGES,
+        )
+        elapsed = time.perf_counter() - started
+        with _pdf_extraction_stats_lock:
+            stats = _pdf_extraction_stats["backends"].setdefault(
+                backend, {"files": 0, "pages": 0, "seconds": 0.0}
+            )
+            stats["files"] += 1
+            stats["pages"] += len(pages)
+            stats["seconds"] += elapsed
+        print(
+            f"Extracted {len(pages)} pages with {backend} in {elapsed:.2f}s "
+            f"({len(pages) / elapsed if elapsed else 0:.1f} pages/sec)"
+        )
+        save_cached_pages(PARSE_CACHE_DIR, cache_key, pages)
+
+    # source and page match PyPDFLoader so page numbers keep working
+    # downstream; its page_label and PDF info fields are not carried over.
+    # content_hash lets deletes find the parse cache entry after the upload
+    # itself is gone.
+    return [
+        Document(
+            page_content=text,
+            metadata={
+                "source": file_path,
+                "page": i,
+                "total_pages": len(pages),
+                "content_hash": content_hash,
+            },
+        )
+        for i, text in enumerate(pages)
+    ]
+
+
+def close_pdf_extraction():
+    """Stops the PDF worker processes."""
+    shutdown_process_pool()
+
+
+def get_pdf_extraction_stats():
+    """Reports parse cache hits and pages/sec per PDF backend."""
+    with _pdf_extraction_stats_lock:
+        backends = {
+            backend: {
+                **stats,
+                "pages_per_second": (
+                    round(stats["pages"] / stats["seconds"], 1)
+                    if stats["seconds"]
+                    else None
+                ),
+            }
+            for backend, stats in _pdf_extraction_stats["backends"].items()
+        }
+        return {"cache_hits": _pdf_extraction_stats["cache_hits"], "backends": backends}
+
+
+def load_and_split_document(
+    file_path, chunk_size=None, chunk_overlap=None, splitter_mode=None
+):
     """Loads a document and splits it into chunks."""
     print(f"Processing document: {file_path}")
     _, file_extension = os.path.splitext(file_path)
     file_extension = file_extension.lower()
 
-    loader = None
+    load = None
     if file_extension == ".pdf":
-        loader = PyPDFLoader(file_path)
+        load = partial(load_pdf_pages, file_path)
     elif file_extension == ".txt":
-        loader = TextLoader(file_path, encoding="utf-8")
+        load = TextLoader(file_path, encoding="utf-8").load
     else:
         print(f"Unsupported file format: {file_extension}")
         return None  # Indicate failure
 
-    if loader:
+    if load:
         try:
-            documents = loader.load()
+            documents = load()
             if not documents:
                 print("No content loaded from document.")
                 return None
 
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=chunk_size,
-                chunk_overlap=chunk_overlap,
-                length_function=len,
-                add_start_index=True,
+            # PDFs load as one document per page, so chunks never span a page break.
+            text_splitter = get_text_splitter(splitter_mode, chunk_size, chunk_overlap)
+            chunks = annotate_chunk_statistics(text_splitter.split_documents(documents))
+            total_tokens = sum(chunk.metadata.get("token_count", 0) for chunk in chunks)
+            print(
+                f"Loaded and split into {len(chunks)} chunks ({total_tokens} tokens)."
             )
-            chunks = text_splitter.split_documents(documents)
-            print(f"Loaded and split into {len(chunks)} chunks.")
             return chunks
         except Exception as e:
             print(f"Error loading/splitting document {file_path}: {e}")
@@ -192,15 +769,75 @@ def load_and_split_document(file_path, chunk_size=1000, chunk_overlap=150):
     return None
 
 
+def split_into_child_chunks(parents, splitter_mode=None):
+    """Splits parent sections into small child chunks linked by parent_id.
+
+    Returns the child chunks and the (parent_id, parent) pairs for the docstore.
+    """
+    splitter_mode = splitter_mode or SPLITTER_MODE
+    child_size, child_overlap = CHILD_CHUNK_SIZES[splitter_mode]
+    child_splitter = get_text_splitter(splitter_mode, child_size, child_overlap)
+
+    children = []
+    parent_items = []
+    for parent in parents:
+        parent_id = str(uuid.uuid4())
+        parent.metadata["parent_id"] = parent_id
+        parent_items.append((parent_id, parent))
+        parent_start = parent.metadata.get("start_index", 0)
+        for child in child_splitter.split_documents([parent]):
+            # make child positions relative to the source, not the parent
+            if child.metadata.get("start_index", -1) >= 0:
+                child.metadata["start_index"] += parent_start
+            children.append(child)
+    return annotate_chunk_statistics(children), parent_items
+
+
 def add_document_to_store(file_path):
-    """Loads, splits and adds documnet to the vector store"""
-    chunks = load_and_split_document(file_path)
+    """Loads, splits and adds documnet to the vector store
+
+    A document re-uploaded under the same path replaces the previous version.
+    """
+    parent_items = []
+    if RETRIEVAL_MODE == "parent":
+        parent_size, parent_overlap = PARENT_CHUNK_SIZES[SPLITTER_MODE]
+        parents = load_and_split_document(file_path, parent_size, parent_overlap)
+        chunks = None
+        if parents:
+            chunks, parent_items = split_into_child_chunks(parents)
+            print(f"Split {len(parents)} parents into {len(chunks)} child chunks.")
+    else:
+        chunks = load_and_split_document(file_path)
     if chunks:
         try:
-            vector_store = get_vector_store()
-            print(f"Adding {len(chunks)} chunks to vector store...")
-            vector_store.add_documents(documents=chunks)
-            print(f"vector_store.add_documents completed.")
+            with _index_lock:
+                manifest = get_manifest()
+                source = chunks[0].metadata.get("source", file_path)
+                old_chunk_ids = manifest.get_entry_ids(source, "chunk")
+                old_parent_ids = manifest.get_entry_ids(source, "parent")
+
+                if parent_items:
+                    # Store parents first so every indexed child can be resolved
+                    get_docstore().mset(parent_items)
+                vector_store = get_vector_store()
+                print(f"Adding {len(chunks)} chunks to vector store...")
+                chunk_ids = [str(uuid.uuid4()) for _ in chunks]
+                vector_store.add_documents(documents=chunks, ids=chunk_ids)
+                print(f"vector_store.add_documents completed.")
+                manifest.add_document(
+                    source,
+                    os.path.basename(file_path),
+                    chunk_ids,
+                    [parent_id for parent_id, _ in parent_items],
+                    sum(chunk.metadata.get("token_count", 0) for chunk in chunks),
+                )
+
+                if old_chunk_ids or old_parent_ids:
+                    old_hash = _get_content_hash(old_chunk_ids)
+                    _delete_entries(old_chunk_ids, old_parent_ids)
+                    print(f"Removed {len(old_chunk_ids)} superseded chunks.")
+                    if old_hash and old_hash != chunks[0].metadata.get("content_hash"):
+                        remove_cached_pages(PARSE_CACHE_DIR, old_hash)
             # Log the count *after* persisting
             current_count = vector_store._collection.count()
             print(f"Vector store count after add: {current_count}")
@@ -219,17 +856,560 @@ def add_document_to_store(file_path):
         return False
 
 
+# Document Lifecycle
+def _delete_entries(chunk_ids, parent_ids):
+    """Removes chunks from the vector store and parents from the docstore."""
+    vector_store = get_vector_store()
+    for i in range(0, len(chunk_ids), STORE_BATCH_SIZE):
+        vector_store.delete(ids=chunk_ids[i : i + STORE_BATCH_SIZE])
+    if parent_ids:
+        get_docstore().mdelete(parent_ids)
+
+    manifest = get_manifest()
+    deleted = int(manifest.get_setting("deleted_since_compaction", 0))
+    manifest.set_setting("deleted_since_compaction", deleted + len(chunk_ids))
+
+
+def _get_content_hash(chunk_ids):
+    """Returns the parsed file's content hash recorded on a document's chunks.
+
+    Every chunk of a document carries the same hash, so one chunk is enough.
+    None for text files and PDFs ingested before the hash was recorded.
+    """
+    if not chunk_ids:
+        return None
+    metadatas = get_vector_store()._collection.get(
+        ids=chunk_ids[:1], include=["metadatas"]
+    )["metadatas"]
+    return (metadatas[0] or {}).get("content_hash") if metadatas else None
+
+
+def list_documents():
+    """Returns the ingested documents recorded in the manifest."""
+    return get_manifest().list_documents()
+
+
+def delete_document(filename):
+    """Removes every chunk and parent of an uploaded file from the index.
+
+    Returns None if no document with that filename was ingested.
+    """
+    with _index_lock:
+        manifest = get_manifest()
+        sources = manifest.find_sources(filename)
+        if not sources:
+            return None
+        deleted_chunks = 0
+        for source in sources:
+            chunk_ids = manifest.get_entry_ids(source, "chunk")
+            content_hash = _get_content_hash(chunk_ids)
+            _delete_entries(chunk_ids, manifest.get_entry_ids(source, "parent"))
+            manifest.remove_document(source)
+            if content_hash:
+                remove_cached_pages(PARSE_CACHE_DIR, content_hash)
+            deleted_chunks += len(chunk_ids)
+    print(f"Deleted document {filename} ({deleted_chunks} chunks).")
+    return {"filename": filename, "deleted_chunks": deleted_chunks}
+
+
+def backfill_manifest():
+    """Records documents ingested before the manifest existed.
+
+    Groups the collection's chunk IDs by their source metadata. Only runs while
+    the manifest is empty.
+    """
+    manifest = get_manifest()
+    collection = get_vector_store()._collection
+    if manifest.count_documents() > 0 or collection.count() == 0:
+        return
+    print("Backfilling document manifest from vector store metadata...")
+    by_source = {}
+    for offset in range(0, collection.count(), STORE_BATCH_SIZE):
+        batch = collection.get(
+            include=["metadatas"], limit=STORE_BATCH_SIZE, offset=offset
+        )
+        for chunk_id, metadata in zip(batch["ids"], batch["metadatas"]):
+            metadata = metadata or {}
+            entry = by_source.setdefault(
+                metadata.get("source", "unknown"),
+                {"chunk_ids": [], "parent_ids": set(), "token_count": 0},
+            )
+            entry["chunk_ids"].append(chunk_id)
+            if metadata.get("parent_id"):
+                entry["parent_ids"].add(metadata["parent_id"])
+            entry["token_count"] += metadata.get("token_count", 0)
+    for source, entry in by_source.items():
+        manifest.add_document(
+            source,
+            os.path.basename(source),
+            entry["chunk_ids"],
+            sorted(entry["parent_ids"]),
+            entry["token_count"],
+        )
+    print(f"Backfilled {len(by_source)} documents into the manifest.")
+
+
+def _directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # file removed while walking
+    return total
+
+
+def _vacuum_chroma_sqlite():
+    """Reclaims the pages left free in chroma.sqlite3 by dropped collections.
+
+    Caller must hold _index_lock so no upload or delete is writing meanwhile.
+    """
+    db_path = os.path.join(CHROMA_DB_DIR, "chroma.sqlite3")
+    if not os.path.exists(db_path):
+        return
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        conn.execute("VACUUM")
+        # Chroma runs in WAL mode; fold the rewritten pages back into the file
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except sqlite3.Error as e:
+        # e.g. a long-running query still reading; retried after the next drop
+        print(f"Could not vacuum {db_path}: {e}")
+    finally:
+        conn.close()
+
+
+def _sqlite_free_ratio(db_path):
+    """Returns the share of pages in a SQLite file that are on the free list."""
+    if not os.path.exists(db_path):
+        return 0.0
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+    return round(free_count / page_count, 4) if page_count else 0.0
+
+
+def _fragmentation():
+    """Returns (live chunks, deleted chunks, deleted share) from the counters."""
+    live_chunks = get_vector_store()._collection.count()
+    deleted_chunks = int(get_manifest().get_setting("deleted_since_compaction", 0))
+    total = live_chunks + deleted_chunks
+    return (
+        live_chunks,
+        deleted_chunks,
+        round(deleted_chunks / total, 4) if total else 0.0,
+    )
+
+
+def get_index_stats():
+    """Reports index size and fragmentation.
+
+    Fragmentation is the share of vector entries deleted since the last
+    compaction; hnswlib only marks those as deleted, so they still take up
+    space and search work until the collection is rebuilt.
+    """
+    collection = get_vector_store()._collection
+    live_chunks, deleted_chunks, fragmentation = _fragmentation()
+    return {
+        "collection": collection.name,
+        "documents": get_manifest().count_documents(),
+        "live_chunks": live_chunks,
+        "deleted_chunks": deleted_chunks,
+        "fragmentation": fragmentation,
+        "disk_bytes": _directory_size(CHROMA_DB_DIR),
+        "sqlite_free_ratio": _sqlite_free_ratio(
+            os.path.join(CHROMA_DB_DIR, "chroma.sqlite3")
+        ),
+    }
+
+
+def needs_compaction():
+    """True once enough of the index has been deleted to be worth rebuilding.
+
+    Cheap enough to call after every upload and delete: it only reads counters.
+    """
+    _, deleted_chunks, fragmentation = _fragmentation()
+    return (
+        deleted_chunks >= COMPACTION_MIN_DELETED
+        and fragmentation >= COMPACTION_FRAGMENTATION_THRESHOLD
+    )
+
+
+def _copy_collection(source, target):
+    """Copies stored embeddings, texts and metadata without re-embedding."""
+    copied = 0
+    for offset in range(0, source.count(), STORE_BATCH_SIZE):
+        batch = source.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=STORE_BATCH_SIZE,
+            offset=offset,
+        )
+        if not batch["ids"]:
+            break
+        target.add(
+            ids=batch["ids"],
+            embeddings=batch["embeddings"],
+            documents=batch["documents"],
+            metadatas=batch["metadatas"],
+        )
+        copied += len(batch["ids"])
+    return copied
+
+
+def _get_retired_collections():
+    return json.loads(get_manifest().get_setting("retired_collections", "[]"))
+
+
+def retire_collection(collection_name):
+    """Schedules a replaced collection to be dropped after the grace period.
+
+    Recorded in the manifest so a restart before the drop still cleans it up.
+    """
+    retired = _get_retired_collections()
+    retired.append({"name": collection_name, "retired_at": time.time()})
+    get_manifest().set_setting("retired_collections", json.dumps(retired))
+    timer = threading.Timer(COLLECTION_DROP_GRACE_SECONDS + 1, drop_retired_collections)
+    timer.daemon = True
+    timer.start()
+
+
+def drop_retired_collections(min_age=None):
+    """Drops retired collections older than min_age seconds.
+
+    Defaults to the grace period; pass 0 at startup, when nothing can still be
+    reading them. chroma.sqlite3 is vacuumed afterwards so the space is
+    returned to the disk, and the last compaction's "after" stats are
+    refreshed once the collection it replaced is gone.
+    """
+    min_age = COLLECTION_DROP_GRACE_SECONDS if min_age is None else min_age
+    with _index_lock:
+        client = get_vector_store()._client
+        active = get_vector_store()._collection.name
+        remaining = []
+        dropped = []
+        for entry in _get_retired_collections():
+            if entry["name"] == active:
+                continue
+            if time.time() - entry["retired_at"] < min_age:
+                remaining.append(entry)
+                continue
+            try:
+                client.delete_collection(entry["name"])
+                print(f"Dropped retired collection '{entry['name']}'.")
+            except Exception as e:
+                # Already gone; nothing left to drop
+                print(f"Could not drop retired collection '{entry['name']}': {e}")
+            dropped.append(entry["name"])
+        get_manifest().set_setting("retired_collections", json.dumps(remaining))
+        if not dropped:
+            return
+        _vacuum_chroma_sqlite()
+        report = _last_compaction_report
+        if report and report.get("retired_collection") in dropped:
+            report["after"] = get_index_stats()
+            report["retired_collection_dropped"] = True
+
+
+def _new_collection_name():
+    # Unique even for rebuilds started within the same second, so a new
+    # collection can never reopen the active one
+    return f"{COLLECTION_NAME}_{uuid.uuid4().hex}"
+
+
+def _drop_unused_collection(collection_name):
+    """Drops a partial rebuild or shadow collection, but never the active one."""
+    if collection_name == get_vector_store()._collection.name:
+        print(f"Refusing to drop the active collection '{collection_name}'.")
+        return False
+    get_vector_store()._client.delete_collection(collection_name)
+    return True
+
+
+def _swap_vector_store(new_store, model_name):
+    """Makes new_store the active collection. Caller must hold _index_lock.
+
+    The old collection is retired rather than dropped, since in-flight
+    queries may still be reading it. Returns the old collection's name.
+    """
+    global _vector_store, _rag_chain
+    old_name = get_vector_store()._collection.name
+    manifest = get_manifest()
+    manifest.set_setting("active_collection", new_store._collection.name)
+    manifest.set_setting("active_embedding_model", model_name)
+    # The rebuilt collection holds no deleted entries
+    manifest.set_setting("deleted_since_compaction", 0)
+    _vector_store = new_store
+    _rag_chain = None  # rebuilt lazily against the new collection
+    retire_collection(old_name)
+    return old_name
+
+
+def compact_vector_store():
+    """Rebuilds the active collection without deleted entries and swaps it in.
+
+    Meant to run as a background task. Queries keep using the old collection
+    until the swap, and it is only dropped after COLLECTION_DROP_GRACE_SECONDS.
+    Uploads and deletes wait for the rebuild to finish. Returns the
+    before/after report, or None if a compaction is already running. Until
+    the replaced collection is dropped its disk space is still in use, so
+    "after" is refreshed by drop_retired_collections.
+    """
+    global _last_compaction_report
+    if not _maintenance_lock.acquire(blocking=False):
+        print("Compaction or embedding migration already running, skipping.")
+        return None
+    new_store = None
+    swapped = False
+    try:
+        before = get_index_stats()
+        print(f"Starting index compaction: {before}")
+        started = time.perf_counter()
+        with _index_lock:
+            old_store = get_vector_store()
+            model_name = get_active_embedding_model()
+            new_store = _open_collection(_new_collection_name(), model_name)
+            copied = _copy_collection(old_store._collection, new_store._collection)
+            old_name = _swap_vector_store(new_store, model_name)
+            swapped = True
+        get_docstore().vacuum()
+        get_manifest().vacuum()
+
+        after = get_index_stats()
+        _last_compaction_report = {
+            "copied_chunks": copied,
+            "duration_seconds": round(time.perf_counter() - started, 3),
+            "before": before,
+            "after": after,
+            "retired_collection": old_name,
+            "retired_collection_dropped": False,
+        }
+        print(f"Index compaction finished: {_last_compaction_report}")
+        return _last_compaction_report
+    except Exception as e:
+        print(f"Error during index compaction: {e}")
+        traceback.print_exc()
+        if new_store is not None and not swapped:
+            try:
+                _drop_unused_collection(new_store._collection.name)
+            except Exception as e_clean:
+                print(f"Error removing partial collection: {e_clean}")
+        return None
+    finally:
+        _maintenance_lock.release()
+
+
+def get_last_compaction_report():
+    return _last_compaction_report
+
+
+# Embedding Model Migration
+def embedding_migration_needed():
+    """True when the configured model differs from the active collection's."""
+    return get_active_embedding_model() != EMBEDDING_MODEL_NAME
+
+
+def _get_all_ids(collection):
+    ids = []
+    for offset in range(0, collection.count(), STORE_BATCH_SIZE):
+        batch = collection.get(include=[], limit=STORE_BATCH_SIZE, offset=offset)
+        ids.extend(batch["ids"])
+    return ids
+
+
+def _reembed(source, target, embedding_function, ids=None, offset=0, limit=None):
+    """Copies chunks from source to target with freshly computed embeddings."""
+    if ids is not None:
+        batch = source.get(ids=ids, include=["documents", "metadatas"])
+    else:
+        batch = source.get(
+            include=["documents", "metadatas"], limit=limit, offset=offset
+        )
+    if batch["ids"]:
+        # upsert: offsets shift when chunks are deleted mid-copy, so a chunk
+        # may be read twice
+        target.upsert(
+            ids=batch["ids"],
+            embeddings=embedding_function.embed_documents(batch["documents"]),
+            documents=batch["documents"],
+            metadatas=batch["metadatas"],
+        )
+    return len(batch["ids"])
+
+
+def migrate_embeddings(target_model=None):
+    """Re-embeds every chunk with target_model into a shadow collection, then swaps.
+
+    Runs in a background thread. Queries and uploads keep using the old
+    collection during the copy, which is throttled to
+    MIGRATION_MAX_CHUNKS_PER_SECOND. Chunks added or deleted meanwhile are
+    reconciled under the index lock just before the swap. The old collection
+    is retired, like after a compaction, so in-flight queries can finish.
+    """
+    target_model = target_model or EMBEDDING_MODEL_NAME
+    if not _maintenance_lock.acquire(blocking=False):
+        print("Compaction or embedding migration already running, skipping.")
+        return False
+    shadow_store = None
+    swapped = False
+    try:
+        manifest = get_manifest()
+        # Drop a shadow collection left behind by an interrupted migration
+        leftover = manifest.get_setting("migration_collection")
+        if leftover:
+            try:
+                if _drop_unused_collection(leftover):
+                    print(f"Removed leftover migration collection '{leftover}'.")
+            except Exception as e:
+                print(f"Could not remove leftover migration collection: {e}")
+
+        old_store = get_vector_store()
+        source_model = get_active_embedding_model()
+        old_collection = old_store._collection
+        embedding_function = get_embedding_function(target_model)
+        shadow_name = _new_collection_name()
+        shadow_store = _open_collection(shadow_name, target_model)
+        manifest.set_setting("migration_collection", shadow_name)
+
+        _migration_status.clear()
+        _migration_status.update(
+            {
+                "state": "running",
+                "source_model": source_model,
+                "target_model": target_model,
+                "total": old_collection.count(),
+                "migrated": 0,
+                "started_at": time.time(),
+            }
+        )
+        print(f"Migrating embeddings from {source_model} to {target_model}...")
+
+        # 1. Throttled bulk copy while the old collection keeps serving
+        min_batch_seconds = (
+            MIGRATION_BATCH_SIZE / MIGRATION_MAX_CHUNKS_PER_SECOND
+            if MIGRATION_MAX_CHUNKS_PER_SECOND > 0
+            else 0
+        )
+        offset = 0
+        while not _migration_stop.is_set():
+            batch_started = time.perf_counter()
+            copied = _reembed(
+                old_collection,
+                shadow_store._collection,
+                embedding_function,
+                offset=offset,
+                limit=MIGRATION_BATCH_SIZE,
+            )
+            if copied == 0:
+                break
+            offset += copied
+            _migration_status["migrated"] = offset
+            elapsed = time.perf_counter() - batch_started
+            if elapsed < min_batch_seconds:
+                _migration_stop.wait(min_batch_seconds - elapsed)
+        if _migration_stop.is_set():
+            raise RuntimeError("Embedding migration stopped before completion.")
+
+        # 2. Catch up on changes made during the copy, then swap atomically
+        with _index_lock:
+            old_ids = set(_get_all_ids(old_collection))
+            shadow_ids = set(_get_all_ids(shadow_store._collection))
+            added = sorted(old_ids - shadow_ids)
+            removed = sorted(shadow_ids - old_ids)
+            for i in range(0, len(added), MIGRATION_BATCH_SIZE):
+                _reembed(
+                    old_collection,
+                    shadow_store._collection,
+                    embedding_function,
+                    ids=added[i : i + MIGRATION_BATCH_SIZE],
+                )
+            for i in range(0, len(removed), STORE_BATCH_SIZE):
+                shadow_store._collection.delete(ids=removed[i : i + STORE_BATCH_SIZE])
+            _swap_vector_store(shadow_store, target_model)
+            manifest.set_setting("migration_collection", "")
+            swapped = True
+
+        _migration_status.update(
+            {
+                "state": "completed",
+                "migrated": len(old_ids),
+                "reconciled_added": len(added),
+                "reconciled_removed": len(removed),
+                "finished_at": time.time(),
+            }
+        )
+        print(f"Embedding migration finished: {_migration_status}")
+        return True
+    except Exception as e:
+        print(f"Error during embedding migration: {e}")
+        traceback.print_exc()
+        _migration_status.update(
+            {"state": "failed", "error": str(e), "finished_at": time.time()}
+        )
+        if shadow_store is not None and not swapped:
+            try:
+                _drop_unused_collection(shadow_store._collection.name)
+                get_manifest().set_setting("migration_collection", "")
+            except Exception as e_clean:
+                print(f"Error removing shadow collection: {e_clean}")
+        return False
+    finally:
+        _maintenance_lock.release()
+
+
+def start_embedding_migration():
+    """Starts migrate_embeddings in a background thread if it is needed.
+
+    Returns True if a migration was started.
+    """
+    if not embedding_migration_needed() or _maintenance_lock.locked():
+        return False
+    _migration_stop.clear()
+    threading.Thread(
+        target=migrate_embeddings, name="embedding-migration", daemon=True
+    ).start()
+    return True
+
+
+def stop_embedding_migration():
+    """Asks a running migration to stop; the old collection stays active."""
+    _migration_stop.set()
+
+
+def get_embedding_status():
+    """Reports the active and configured embedding models and migration progress."""
+    return {
+        "active_model": get_active_embedding_model(),
+        "configured_model": EMBEDDING_MODEL_NAME,
+        "migration": dict(_migration_status),
+    }
+
+
 def query_documnents(query_text):
-    """Queries the documents using the QA chain"""
+    """Queries the documents using the QA chain
+
+    Every answer returned, including the empty-store and error messages, is
+    recorded in the audit log.
+    """
     print(f"Received query: '{query_text}'")
+    started = time.perf_counter()
     rag_chain = get_rag_chain()
     vector_store = get_vector_store()
 
     # Optional: Check if vector store is empty before querying
     if vector_store._collection.count() == 0:
         print("Vector store is empty. Cannot answer query.")
+        answer = (
+            "I haven't processed any documents yet. Please upload a document first."
+        )
+        get_audit_log().record(
+            query_text, [], answer, (time.perf_counter() - started) * 1000
+        )
         return {
-            "answer": "I haven't processed any documents yet. Please upload a document first.",
+            "answer": answer,
             "source_documents": [],
         }
 
@@ -238,13 +1418,19 @@ def query_documnents(query_text):
         print(f"Invoking LCEL RAG chain with query: '{query_text}'")
         # The LCEL chain as defined expects the query string directly as input
         # because RunnablePassthrough() is used for the "question" field.
-        answer = rag_chain.invoke(query_text)
+        result = rag_chain.invoke(query_text)
+        answer = result["answer"]
+        latency_ms = (time.perf_counter() - started) * 1000
         print(f"LCEL RAG chain executed. Answer: {answer[:100]}...")
 
+        # Queued for the background writer; does not wait for the write
+        get_audit_log().record(
+            query_text, get_retrieved_ids(result["docs"]), answer, latency_ms
+        )
+
         # --- Handling Source Documents (LCEL Basic) ---
-        # The basic LCEL chain above doesn't easily return source documents.
-        # To return sources, the chain needs modification (e.g., using RunnableParallel
-        # to pass retriever output through). For now, returning empty list.
+        # The retrieved documents are available in result["docs"] but are not
+        # returned to the client yet. For now, returning empty list.
         formatted_sources = []
         print(f"Query answered (sources not retrieved in this basic LCEL setup).")
 
@@ -253,8 +1439,12 @@ def query_documnents(query_text):
     except Exception as e:
         print(f"Error during LCEL RAG chain execution: {e}")
         traceback.print_exc()  # Print full traceback
+        answer = f"An error occurred during RAG chain execution: {e}"
+        get_audit_log().record(
+            query_text, [], answer, (time.perf_counter() - started) * 1000
+        )
         # Return structure consistent with expected QueryResponse
         return {
-            "answer": f"An error occurred during RAG chain execution: {e}",
+            "answer": answer,
             "source_documents": [],
         }
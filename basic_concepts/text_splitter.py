@@ -3,15 +3,26 @@ from basic_concepts.document_loader import load_document
 import os
 
 
-def split_documents(documents, chunk_size=1000, chunk_overlap=150):
-    """Split loaded documnets into smaller chunks"""
+def split_documents(documents, chunk_size=None, chunk_overlap=None, by_tokens=False):
+    """Split loaded documnets into smaller chunks
+
+    With by_tokens=True this uses the app's token splitter: sizes are measured
+    with the embedding model's tokenizer, chunks prefer heading and paragraph
+    boundaries, and chunk_size defaults to the model's input limit.
+    """
     print(f"Splitting {len(documents)} documnets sections into chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-        add_start_index=True,  # helpful for context
-    )
+    if by_tokens:
+        # Imported here so the character path does not load the embedding model
+        from app.rag_processor import get_text_splitter
+
+        text_splitter = get_text_splitter("token", chunk_size, chunk_overlap)
+    else:
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size or 1000,
+            chunk_overlap=150 if chunk_overlap is None else chunk_overlap,
+            length_function=len,
+            add_start_index=True,  # helpful for context
+        )
     chunks = text_splitter.split_documents(documents)
     print(f"Created {len(chunks)} chunks.")
     return chunks
@@ -0,0 +1,32 @@
+import pytest
+
+
+@pytest.fixture
+def text_pdf(tmp_path):
+    """Returns a function that writes a PDF with one line of text per page."""
+    pypdf = pytest.importorskip("pypdf")
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    def write(name, texts):
+        writer = pypdf.PdfWriter()
+        font = DictionaryObject(
+            {
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/Helvetica"),
+            }
+        )
+        for text in texts:
+            page = writer.add_blank_page(width=300, height=100)
+            page[NameObject("/Resources")] = DictionaryObject(
+                {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})}
+            )
+            content = DecodedStreamObject()
+            content.set_data(f"BT /F1 12 Tf 10 50 Td ({text}) Tj ET".encode())
+            page.replace_contents(content)
+        path = tmp_path / name
+        with open(path, "wb") as f:
+            writer.write(f)
+        return str(path)
+
+    return write
@@ -108,3 +108,49 @@ def test_query_empty_input():
     response = client.post("/query", json={"query": ""})
     assert response.status_code == 400  # Should be caught by FastAPI/Pydantic
     assert "Query cannot be empty" in response.json()["detail"]
+
+
+def test_list_documents_after_upload(test_txt_file_path):
+    """Uploaded documents are listed with their chunk counts."""
+    with open(test_txt_file_path, "rb") as f:
+        client.post("/upload", files={"file": ("test_upload.txt", f, "text/plain")})
+
+    response = client.get("/documents")
+    assert response.status_code == 200
+    documents = {doc["filename"]: doc for doc in response.json()}
+    assert "test_upload.txt" in documents
+    assert documents["test_upload.txt"]["chunk_count"] > 0
+
+
+def test_delete_document(test_txt_file_path):
+    """Deleting a document removes it from the listing."""
+    with open(test_txt_file_path, "rb") as f:
+        client.post("/upload", files={"file": ("test_upload.txt", f, "text/plain")})
+
+    response = client.delete("/documents/test_upload.txt")
+    assert response.status_code == 200
+    assert response.json()["deleted_chunks"] > 0
+
+    filenames = [doc["filename"] for doc in client.get("/documents").json()]
+    assert "test_upload.txt" not in filenames
+
+
+def test_delete_unknown_document():
+    response = client.delete("/documents/never_uploaded.txt")
+    assert response.status_code == 404
+
+
+def test_index_stats():
+    response = client.get("/documents/stats")
+    assert response.status_code == 200
+    assert 0.0 <= response.json()["index"]["fragmentation"] <= 1.0
+
+
+def test_embedding_status():
+    """The active embedding model is recorded and reported."""
+    response = client.get("/embeddings/status")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["active_model"]
+    assert data["configured_model"]
+    assert data["migration"]["state"] in {"idle", "running", "completed", "failed"}
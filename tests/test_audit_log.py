@@ -0,0 +1,147 @@
+import json
+import sqlite3
+import threading
+import time
+
+from app.audit_log import AuditLog
+
+
+def _rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT question, chunk_ids, answer FROM audit_log ORDER BY id"
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def test_close_flushes_queued_entries(tmp_path):
+    """Every recorded entry is on disk once close() returns."""
+    db_path = str(tmp_path / "audit.sqlite3")
+    audit_log = AuditLog(db_path, batch_size=7, flush_interval=60)
+    for i in range(50):
+        audit_log.record(f"question {i}", [f"chunk-{i}"], f"answer {i}", 12.5)
+    audit_log.close()
+
+    rows = _rows(db_path)
+    assert len(rows) == 50
+    assert rows[0] == ("question 0", json.dumps(["chunk-0"]), "answer 0")
+    assert rows[-1][0] == "question 49"
+    assert audit_log.stats()["written"] == 50
+
+
+def test_full_queue_applies_backpressure(tmp_path):
+    """A full queue makes record() wait instead of dropping entries."""
+    db_path = str(tmp_path / "audit.sqlite3")
+    audit_log = AuditLog(db_path, max_queue_size=2, batch_size=1)
+    for i in range(200):
+        audit_log.record(f"question {i}", [], "answer")
+    audit_log.close()
+
+    assert len(_rows(db_path)) == 200
+
+
+def test_stats_report_overhead(tmp_path):
+    audit_log = AuditLog(str(tmp_path / "audit.sqlite3"))
+    audit_log.record("question", ["a", "b"], "answer", latency_ms=250.0)
+    stats = audit_log.stats()
+    audit_log.close()
+
+    assert stats["record_overhead_ms"]["p99"] is not None
+    assert stats["query_latency_ms"]["p99"] == 250.0
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+def test_failed_batches_are_retried(tmp_path):
+    """Entries from a failed write are kept and written once the database recovers."""
+    db_path = str(tmp_path / "audit.sqlite3")
+    audit_log = AuditLog(db_path, flush_interval=0.05)
+    conn = sqlite3.connect(db_path)
+    conn.execute("ALTER TABLE audit_log RENAME TO audit_log_moved")
+    conn.commit()
+
+    audit_log.record("question 1", [], "answer 1")
+    _wait_for(lambda: audit_log.stats()["unwritten"] == 1)
+    assert audit_log.stats()["write_errors"] >= 3
+
+    conn.execute("ALTER TABLE audit_log_moved RENAME TO audit_log")
+    conn.commit()
+    conn.close()
+    audit_log.record("question 2", [], "answer 2")
+    audit_log.close()
+
+    assert [row[0] for row in _rows(db_path)] == ["question 1", "question 2"]
+    assert audit_log.stats()["unwritten"] == 0
+
+
+def test_unwritable_entries_are_spilled_on_close(tmp_path):
+    db_path = str(tmp_path / "audit.sqlite3")
+    audit_log = AuditLog(db_path, flush_interval=60)
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP TABLE audit_log")
+    conn.commit()
+    conn.close()
+
+    audit_log.record("question", ["chunk-1"], "answer")
+    audit_log.close()
+
+    with open(audit_log.spill_path, encoding="utf-8") as f:
+        spilled = [json.loads(line) for line in f]
+    assert [entry["question"] for entry in spilled] == ["question"]
+    assert audit_log.stats()["spilled"] == 1
+
+
+def test_failing_writes_block_record_instead_of_buffering(tmp_path):
+    """While writes fail, unwritten entries stay bounded by the queue size."""
+    db_path = str(tmp_path / "audit.sqlite3")
+    audit_log = AuditLog(db_path, max_queue_size=10, batch_size=4, flush_interval=0.05)
+    conn = sqlite3.connect(db_path)
+    conn.execute("ALTER TABLE audit_log RENAME TO audit_log_moved")
+    conn.commit()
+
+    recorded = []
+
+    def record_many():
+        for i in range(100):
+            audit_log.record(f"question {i}", [], "answer")
+            recorded.append(i)
+
+    writer = threading.Thread(target=record_many, daemon=True)
+    writer.start()
+    _wait_for(lambda: audit_log.stats()["backpressure_waits"] > 0)
+    time.sleep(0.3)
+    stats = audit_log.stats()
+    assert stats["unwritten"] <= 10
+    assert len(recorded) <= 10 + 10 + 1  # retry buffer + queue + one in flight
+
+    # Once the database recovers, everything blocked in record() is written
+    conn.execute("ALTER TABLE audit_log_moved RENAME TO audit_log")
+    conn.commit()
+    conn.close()
+    writer.join(10)
+    audit_log.close()
+
+    assert len(_rows(db_path)) == 100
+    assert audit_log.stats()["unwritten"] == 0
+
+
+def test_close_does_not_hang_on_a_stalled_writer(tmp_path):
+    db_path = str(tmp_path / "audit.sqlite3")
+    audit_log = AuditLog(db_path, max_queue_size=5, flush_interval=0.05)
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP TABLE audit_log")
+    conn.commit()
+    conn.close()
+
+    for i in range(10):
+        audit_log.record(f"question {i}", [], "answer")
+    audit_log.close(timeout=10)
+
+    assert audit_log.stats()["spilled"] == 10
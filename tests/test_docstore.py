@@ -0,0 +1,36 @@
+from langchain_core.documents import Document
+
+from app.docstore import SQLiteDocStore
+
+
+def test_docstore_roundtrip(tmp_path):
+    """Documents survive a close and reopen of the SQLite file."""
+    db_path = str(tmp_path / "docstore.sqlite3")
+    store = SQLiteDocStore(db_path)
+    store.mset(
+        [
+            ("p1", Document(page_content="first", metadata={"source": "a.txt"})),
+            ("p2", Document(page_content="second", metadata={"page": 2})),
+        ]
+    )
+    store.close()
+
+    store = SQLiteDocStore(db_path)
+    first, missing, second = store.mget(["p1", "nope", "p2"])
+    assert first.page_content == "first"
+    assert first.metadata == {"source": "a.txt"}
+    assert missing is None
+    assert second.metadata == {"page": 2}
+    assert store.count() == 2
+
+
+def test_docstore_delete_and_keys(tmp_path):
+    store = SQLiteDocStore(str(tmp_path / "docstore.sqlite3"))
+    store.mset([(f"doc-{i}", Document(page_content=str(i))) for i in range(3)])
+    store.mset([("other", Document(page_content="x"))])
+
+    store.mdelete(["doc-1", "not-there"])
+
+    assert sorted(store.yield_keys(prefix="doc-")) == ["doc-0", "doc-2"]
+    assert store.mget(["doc-1"]) == [None]
+    assert store.count() == 3
@@ -0,0 +1,35 @@
+from app.manifest import DocumentManifest
+
+
+def test_manifest_records_and_replaces_documents(tmp_path):
+    """Re-adding a source replaces its previous chunk IDs."""
+    manifest = DocumentManifest(str(tmp_path / "manifest.sqlite3"))
+    manifest.add_document("uploads/a.txt", "a.txt", ["c1", "c2"], ["p1"], 42)
+    manifest.add_document("uploads/a.txt", "a.txt", ["c3"], [], 7)
+
+    assert manifest.get_entry_ids("uploads/a.txt", "chunk") == ["c3"]
+    assert manifest.get_entry_ids("uploads/a.txt", "parent") == []
+    [document] = manifest.list_documents()
+    assert document["filename"] == "a.txt"
+    assert document["chunk_count"] == 1
+    assert document["token_count"] == 7
+
+
+def test_manifest_remove_document(tmp_path):
+    manifest = DocumentManifest(str(tmp_path / "manifest.sqlite3"))
+    manifest.add_document("uploads/a.txt", "a.txt", ["c1"])
+    manifest.add_document("uploads/b.txt", "b.txt", ["c2"])
+
+    manifest.remove_document("uploads/a.txt")
+
+    assert manifest.find_sources("a.txt") == []
+    assert manifest.find_sources("b.txt") == ["uploads/b.txt"]
+    assert manifest.get_entry_ids("uploads/a.txt", "chunk") == []
+    assert manifest.count_documents() == 1
+
+
+def test_manifest_settings(tmp_path):
+    manifest = DocumentManifest(str(tmp_path / "manifest.sqlite3"))
+    assert manifest.get_setting("active_collection", "default") == "default"
+    manifest.set_setting("deleted_since_compaction", 12)
+    assert manifest.get_setting("deleted_since_compaction") == "12"
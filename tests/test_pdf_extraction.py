@@ -0,0 +1,86 @@
+import pytest
+
+from app import pdf_extraction
+from app.pdf_extraction import (
+    count_pages,
+    extract_page_range,
+    extract_pdf_pages,
+    file_content_hash,
+    load_cached_pages,
+    page_ranges,
+    remove_cached_pages,
+    save_cached_pages,
+)
+
+
+def test_page_ranges_cover_every_page_once():
+    ranges = page_ranges(10, 3)
+    assert ranges == [(0, 4), (4, 7), (7, 10)]
+    assert page_ranges(2, 8) == [(0, 1), (1, 2)]
+
+
+def test_parallel_extraction_matches_serial(text_pdf):
+    """Page ranges parsed across the process pool come back in page order."""
+    texts = [f"Page number {i}" for i in range(7)]
+    path = text_pdf("doc.pdf", texts)
+    try:
+        parallel = extract_pdf_pages(path, max_workers=3, min_pages=2)
+        assert pdf_extraction._process_pool is not None
+    finally:
+        pdf_extraction.shutdown_process_pool()
+
+    serial = extract_page_range(path, "pypdf", 0, count_pages(path))
+    assert len(parallel) == len(texts)
+    assert parallel == serial
+    assert [page.strip() for page in parallel] == texts
+
+
+def test_pymupdf_matches_pypdf(text_pdf):
+    """Both backends see the same pages, serially and across the process pool."""
+    pytest.importorskip("pymupdf")
+    texts = [f"Page number {i}" for i in range(5)]
+    path = text_pdf("doc.pdf", texts)
+
+    assert count_pages(path, "pymupdf") == count_pages(path, "pypdf") == 5
+    serial = extract_page_range(path, "pymupdf", 0, 5)
+    try:
+        parallel = extract_pdf_pages(path, "pymupdf", max_workers=2, min_pages=2)
+    finally:
+        pdf_extraction.shutdown_process_pool()
+    pypdf_pages = extract_page_range(path, "pypdf", 0, 5)
+
+    assert parallel == serial
+    assert [page.strip() for page in serial] == [page.strip() for page in pypdf_pages]
+    assert [page.strip() for page in serial] == texts
+
+
+def test_parse_cache_roundtrip(tmp_path):
+    """Cached pages are keyed by file content, not by file name."""
+    first = tmp_path / "first.pdf"
+    second = tmp_path / "second.pdf"
+    first.write_bytes(b"%PDF-1.4 same bytes")
+    second.write_bytes(b"%PDF-1.4 same bytes")
+    cache_dir = str(tmp_path / "cache")
+
+    key = f"{file_content_hash(str(first))}-pypdf"
+    assert load_cached_pages(cache_dir, key) is None
+    save_cached_pages(cache_dir, key, ["page one", "page two"])
+
+    second_key = f"{file_content_hash(str(second))}-pypdf"
+    assert load_cached_pages(cache_dir, second_key) == ["page one", "page two"]
+
+
+def test_remove_cached_pages_covers_every_backend(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    save_cached_pages(cache_dir, "abc-pypdf", ["one"])
+    save_cached_pages(cache_dir, "abc-pymupdf", ["one"])
+    save_cached_pages(cache_dir, "def-pypdf", ["two"])
+
+    assert remove_cached_pages(cache_dir, "abc") == 2
+    assert load_cached_pages(cache_dir, "abc-pypdf") is None
+    assert load_cached_pages(cache_dir, "def-pypdf") == ["two"]
+
+
+def test_unknown_backend(tmp_path):
+    with pytest.raises(ValueError, match="Unknown PDF backend"):
+        count_pages(str(tmp_path / "doc.pdf"), "not-a-backend")
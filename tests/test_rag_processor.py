@@ -0,0 +1,520 @@
+import os
+import threading
+import time
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app import rag_processor
+from app.rag_processor import (
+    annotate_chunk_statistics,
+    count_embedding_tokens,
+    count_tokens,
+    get_text_splitter,
+    split_into_child_chunks,
+)
+
+
+class TaggedEmbeddings(Embeddings):
+    """Tiny deterministic embeddings whose last dimension identifies the model."""
+
+    def __init__(self, tag):
+        self.tag = tag
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), float(sum(map(ord, text)) % 97), self.tag]
+
+
+MODEL_TAGS = {rag_processor.DEFAULT_EMBEDDING_MODEL_NAME: 1.0, "other-model": 2.0}
+
+
+@pytest.fixture
+def isolated_store(tmp_path, monkeypatch):
+    """Points the vector store, manifest and docstore at a temporary directory."""
+    chroma_dir = str(tmp_path / "chroma_db")
+    monkeypatch.setattr(rag_processor, "CHROMA_DB_DIR", chroma_dir)
+    monkeypatch.setattr(
+        rag_processor, "MANIFEST_PATH", os.path.join(chroma_dir, "manifest.sqlite3")
+    )
+    monkeypatch.setattr(
+        rag_processor, "DOCSTORE_PATH", os.path.join(chroma_dir, "docstore.sqlite3")
+    )
+    for name in ("_vector_store", "_manifest", "_docstore", "_rag_chain"):
+        monkeypatch.setattr(rag_processor, name, None)
+    embeddings = {name: TaggedEmbeddings(tag) for name, tag in MODEL_TAGS.items()}
+    monkeypatch.setattr(
+        rag_processor,
+        "get_embedding_function",
+        lambda model_name=None: embeddings[
+            model_name or rag_processor.get_active_embedding_model()
+        ],
+    )
+    return chroma_dir
+
+
+# --- Chunking ---
+
+
+def test_token_splitter_respects_chunk_size():
+    """Token mode chunks never exceed the token budget."""
+    text = "\n\n".join(
+        f"## Section {i}\n" + "This sentence is about testing. " * 30 for i in range(5)
+    )
+    splitter = get_text_splitter("token", chunk_size=64, chunk_overlap=8)
+    chunks = splitter.split_documents([Document(page_content=text)])
+
+    assert len(chunks) > 1
+    assert all(count_embedding_tokens(chunk.page_content) <= 64 for chunk in chunks)
+
+
+def test_token_splitter_fits_embedding_model_by_default():
+    """Default token-mode chunks are never truncated by the embedding model."""
+    text = " ".join(f"Sentence number {i} mentions tokenization." for i in range(400))
+    splitter = get_text_splitter("token")
+    chunks = splitter.split_documents([Document(page_content=text)])
+
+    max_tokens = rag_processor.get_max_embedding_tokens()
+    assert len(chunks) > 1
+    assert all(count_embedding_tokens(c.page_content) <= max_tokens for c in chunks)
+
+
+def test_token_splitter_starts_chunks_at_headings():
+    """Headings are preferred split points over paragraphs and sentences."""
+    text = "# First\nShort intro.\n## Second\nAnother short part."
+    splitter = get_text_splitter("token", chunk_size=8, chunk_overlap=0)
+    chunks = splitter.split_documents([Document(page_content=text)])
+
+    assert [chunk.page_content for chunk in chunks] == [
+        "# First\nShort intro.",
+        "## Second\nAnother short part.",
+    ]
+
+
+def test_unknown_splitter_mode():
+    try:
+        get_text_splitter("words")
+    except ValueError as e:
+        assert "Unknown splitter mode" in str(e)
+    else:
+        raise AssertionError("Expected ValueError for unknown splitter mode")
+
+
+def test_chunk_statistics_metadata():
+    """Chunk statistics are recorded per source at ingest time."""
+    docs = [
+        Document(page_content="alpha beta", metadata={"source": "a.txt"}),
+        Document(page_content="gamma", metadata={"source": "b.txt"}),
+        Document(page_content="delta epsilon", metadata={"source": "a.txt"}),
+    ]
+    splitter = get_text_splitter("character", chunk_size=100, chunk_overlap=0)
+    chunks = annotate_chunk_statistics(splitter.split_documents(docs))
+
+    assert [chunk.metadata["chunk_index"] for chunk in chunks] == [0, 0, 1]
+    for chunk in chunks:
+        assert chunk.metadata.get("token_count") == count_tokens(chunk.page_content)
+        assert chunk.metadata["char_count"] == len(chunk.page_content)
+        assert (
+            chunk.metadata["end_index"]
+            == chunk.metadata["start_index"] + chunk.metadata["char_count"]
+        )
+
+
+def test_chunk_statistics_without_tiktoken(monkeypatch):
+    """An unavailable tiktoken encoding skips token_count instead of failing."""
+    monkeypatch.setattr(rag_processor, "_token_encoding", None)
+    monkeypatch.setattr(rag_processor, "_token_encoding_failed", True)
+    chunks = annotate_chunk_statistics(
+        [Document(page_content="alpha beta", metadata={"source": "a.txt"})]
+    )
+
+    assert "token_count" not in chunks[0].metadata
+    assert chunks[0].metadata["char_count"] == len("alpha beta")
+
+
+# --- PDF extraction ---
+
+
+def test_load_pdf_pages_uses_parse_cache(text_pdf, tmp_path, monkeypatch):
+    """Pages carry page metadata; a second load is served from the parse cache."""
+    texts = [f"Page number {i}" for i in range(5)]
+    path = text_pdf("doc.pdf", texts)
+    monkeypatch.setattr(rag_processor, "PARSE_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(rag_processor, "PDF_PARALLEL_MIN_PAGES", 2)
+    monkeypatch.setattr(rag_processor, "PDF_MAX_WORKERS", 2)
+    monkeypatch.setattr(
+        rag_processor, "_pdf_extraction_stats", {"cache_hits": 0, "backends": {}}
+    )
+
+    try:
+        first = rag_processor.load_pdf_pages(path, backend="pypdf")
+    finally:
+        rag_processor.close_pdf_extraction()
+    stats = rag_processor.get_pdf_extraction_stats()
+    assert [doc.page_content.strip() for doc in first] == texts
+    assert [doc.metadata["page"] for doc in first] == list(range(5))
+    assert all(doc.metadata["total_pages"] == 5 for doc in first)
+    assert all(doc.metadata["source"] == path for doc in first)
+    assert stats["cache_hits"] == 0
+    assert stats["backends"]["pypdf"]["files"] == 1
+    assert stats["backends"]["pypdf"]["pages"] == 5
+    assert stats["backends"]["pypdf"]["pages_per_second"] > 0
+
+    second = rag_processor.load_pdf_pages(path, backend="pypdf")
+    stats = rag_processor.get_pdf_extraction_stats()
+    assert [doc.page_content for doc in second] == [doc.page_content for doc in first]
+    assert [doc.metadata for doc in second] == [doc.metadata for doc in first]
+    assert stats["cache_hits"] == 1
+    assert stats["backends"]["pypdf"]["files"] == 1
+
+
+def test_delete_document_removes_parse_cache_entry(
+    isolated_store, text_pdf, tmp_path, monkeypatch
+):
+    cache_dir = str(tmp_path / "cache")
+    monkeypatch.setattr(rag_processor, "PARSE_CACHE_DIR", cache_dir)
+    monkeypatch.setattr(rag_processor, "SPLITTER_MODE", "character")
+    monkeypatch.setattr(rag_processor, "RETRIEVAL_MODE", "chunk")
+    path = text_pdf("doc.pdf", ["First page", "Second page"])
+    cache_key = f"{rag_processor.file_content_hash(path)}-pypdf"
+
+    assert rag_processor.add_document_to_store(path)
+    assert rag_processor.load_cached_pages(cache_dir, cache_key) is not None
+
+    assert rag_processor.delete_document("doc.pdf")["deleted_chunks"] == 2
+    assert rag_processor.load_cached_pages(cache_dir, cache_key) is None
+
+
+# --- Parent documents ---
+
+
+def test_child_chunks_link_to_parents():
+    """Each child points at its parent and carries source-relative positions."""
+    parent = Document(
+        page_content="word " * 400,
+        metadata={"source": "a.txt", "start_index": 5000},
+    )
+    children, parent_items = split_into_child_chunks([parent], "character")
+
+    assert len(parent_items) == 1
+    parent_id, stored_parent = parent_items[0]
+    assert stored_parent.metadata["parent_id"] == parent_id
+    assert len(children) > 1
+    assert all(child.metadata["parent_id"] == parent_id for child in children)
+    assert children[0].metadata["start_index"] == 5000
+    assert all(child.metadata["char_count"] <= 400 for child in children)
+
+
+# --- Query expansion ---
+
+
+def test_expansions_are_cached_and_deduplicated(monkeypatch):
+    """Expansions are generated once per question and never repeat it."""
+    calls = []
+
+    def fake_generate(kind, query_text):
+        calls.append(kind)
+        return ["What is it about?", "what is this document about?", "Main topic?"]
+
+    monkeypatch.setattr(rag_processor, "QUERY_EXPANSION", ["multi_query"])
+    monkeypatch.setattr(rag_processor, "_generate_expansions", fake_generate)
+    rag_processor._expansion_cache.clear()
+
+    first = rag_processor.expand_query("What is this document about?")
+    second = rag_processor.expand_query("what is  this document about?")
+
+    assert first == ["What is it about?", "Main topic?"]
+    assert second == first
+    assert calls == ["multi_query"]
+
+
+def test_slow_expansions_respect_latency_budget(monkeypatch):
+    """Expansions that overrun the budget are skipped but cached when they finish."""
+    finished = threading.Event()
+
+    def slow_generate(kind, query_text):
+        time.sleep(0.3)
+        finished.set()
+        return ["A hypothetical answer."]
+
+    monkeypatch.setattr(rag_processor, "QUERY_EXPANSION", ["hyde"])
+    monkeypatch.setattr(rag_processor, "EXPANSION_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(rag_processor, "_generate_expansions", slow_generate)
+    rag_processor._expansion_cache.clear()
+
+    started = time.perf_counter()
+    assert rag_processor.expand_query("Slow question?") == []
+    assert time.perf_counter() - started < 0.25
+
+    # The result lands in the cache from the future's done-callback, which
+    # runs just after the generator returns
+    assert finished.wait(2)
+    deadline = time.monotonic() + 2
+    while not rag_processor._expansion_cache and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert rag_processor.expand_query("Slow question?") == ["A hypothetical answer."]
+
+
+def test_queued_expansions_are_cancelled_after_the_budget(monkeypatch):
+    """Expansions stuck behind a slow LLM do not pile up on the executor."""
+    release = threading.Event()
+    started = []
+
+    def blocked_generate(kind, query_text):
+        started.append(query_text)
+        release.wait(5)
+        return ["late"]
+
+    monkeypatch.setattr(rag_processor, "QUERY_EXPANSION", ["hyde"])
+    monkeypatch.setattr(rag_processor, "EXPANSION_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(rag_processor, "_generate_expansions", blocked_generate)
+    executor = rag_processor.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(rag_processor, "_expansion_executor", executor)
+    rag_processor._expansion_cache.clear()
+    try:
+        assert rag_processor.expand_query("First question?") == []
+        # The only worker is busy, so this one never starts and is cancelled
+        assert rag_processor.expand_query("Second question?") == []
+    finally:
+        release.set()
+        executor.shutdown(wait=True)
+
+    assert started == ["First question?"]
+    assert ("hyde", "first question?") in rag_processor._expansion_cache
+    assert ("hyde", "second question?") not in rag_processor._expansion_cache
+
+
+# --- Index maintenance ---
+
+
+def test_compaction_keeps_only_live_chunks(isolated_store, monkeypatch):
+    """Compaction swaps in a collection holding exactly the live chunks."""
+    monkeypatch.setattr(rag_processor, "COMPACTION_MIN_DELETED", 5)
+    store = rag_processor.get_vector_store()
+    ids = [f"chunk-{i}" for i in range(20)]
+    store.add_texts([f"text number {i}" for i in range(20)], ids=ids)
+    old_name = store._collection.name
+
+    rag_processor._delete_entries(ids[:10], [])
+    assert rag_processor.needs_compaction()
+
+    report = rag_processor.compact_vector_store()
+
+    new_store = rag_processor.get_vector_store()
+    manifest = rag_processor.get_manifest()
+    assert new_store._collection.name != old_name
+    assert manifest.get_setting("active_collection") == new_store._collection.name
+    assert manifest.get_setting("deleted_since_compaction") == "0"
+    assert sorted(new_store._collection.get(include=[])["ids"]) == sorted(ids[10:])
+    assert report["copied_chunks"] == 10
+    assert report["before"]["fragmentation"] == 0.5
+    assert report["after"]["fragmentation"] == 0.0
+    assert not rag_processor.needs_compaction()
+
+
+def test_replaced_collection_is_dropped_after_grace_period(isolated_store):
+    """The pre-compaction collection stays readable until it is retired for good."""
+    store = rag_processor.get_vector_store()
+    store.add_texts(["some text"], ids=["chunk-0"])
+    old_name = store._collection.name
+
+    rag_processor.compact_vector_store()
+
+    # Still queryable by anyone holding the old store
+    assert store._collection.get(ids=["chunk-0"])["ids"] == ["chunk-0"]
+    retired = [entry["name"] for entry in rag_processor._get_retired_collections()]
+    assert retired == [old_name]
+
+    rag_processor.drop_retired_collections(min_age=0)
+
+    client = rag_processor.get_vector_store()._client
+    assert old_name not in client.list_collections()  # names in chromadb 0.6
+    assert rag_processor._get_retired_collections() == []
+
+
+def test_compaction_report_is_refreshed_after_drop(isolated_store, monkeypatch):
+    """Disk usage in the report reflects the dropped collection and VACUUM."""
+    monkeypatch.setattr(rag_processor, "_last_compaction_report", None)
+    store = rag_processor.get_vector_store()
+    ids = [f"chunk-{i}" for i in range(300)]
+    store.add_texts([f"text number {i} " * 20 for i in range(300)], ids=ids)
+    rag_processor._delete_entries(ids[:150], [])
+
+    report = rag_processor.compact_vector_store()
+    assert report["retired_collection"] == store._collection.name
+    assert not report["retired_collection_dropped"]
+    # Both collections are still on disk during the grace period
+    disk_bytes_before_drop = report["after"]["disk_bytes"]
+
+    rag_processor.drop_retired_collections(min_age=0)
+
+    report = rag_processor.get_last_compaction_report()
+    assert report["retired_collection_dropped"]
+    assert report["after"]["disk_bytes"] < disk_bytes_before_drop
+    assert report["after"]["sqlite_free_ratio"] == 0.0
+
+
+def test_compactions_in_the_same_second_use_distinct_collections(
+    isolated_store, monkeypatch
+):
+    monkeypatch.setattr(rag_processor.time, "time", lambda: 1700000000.0)
+    store = rag_processor.get_vector_store()
+    store.add_texts(["some text"], ids=["chunk-0"])
+    names = [store._collection.name]
+
+    for _ in range(2):
+        rag_processor.compact_vector_store()
+        names.append(rag_processor.get_vector_store()._collection.name)
+
+    assert len(set(names)) == 3
+    active = rag_processor.get_vector_store()._collection
+    assert active.get(ids=["chunk-0"])["ids"] == ["chunk-0"]
+
+
+# --- Embedding migration ---
+
+
+class RecordingEvent(threading.Event):
+    """Stop event that records throttle waits instead of sleeping."""
+
+    def __init__(self):
+        super().__init__()
+        self.waits = []
+
+    def wait(self, timeout=None):
+        self.waits.append(timeout)
+        return self.is_set()
+
+
+def add_chunks(store, count):
+    ids = [f"chunk-{i}" for i in range(count)]
+    store.add_texts(
+        [f"text number {i}" for i in range(count)],
+        metadatas=[{"source": "a.txt"} for _ in ids],
+        ids=ids,
+    )
+    return ids
+
+
+def test_migration_reconciles_changes_made_during_copy(isolated_store, monkeypatch):
+    """The swapped-in collection holds exactly the live chunks, re-embedded."""
+    monkeypatch.setattr(rag_processor, "MIGRATION_BATCH_SIZE", 4)
+    monkeypatch.setattr(rag_processor, "MIGRATION_MAX_CHUNKS_PER_SECOND", 0)
+    monkeypatch.setattr(rag_processor, "_migration_stop", RecordingEvent())
+    store = rag_processor.get_vector_store()
+    ids = add_chunks(store, 10)
+    old_name = store._collection.name
+
+    real_reembed = rag_processor._reembed
+    calls = []
+
+    def reembed_with_concurrent_writes(*args, **kwargs):
+        copied = real_reembed(*args, **kwargs)
+        calls.append(kwargs)
+        if len(calls) == 1:
+            # An upload and a delete land while the bulk copy is running
+            store.add_texts(
+                ["a late upload"], metadatas=[{"source": "b.txt"}], ids=["late"]
+            )
+            store.delete(ids=["chunk-0", "chunk-5"])
+        return copied
+
+    monkeypatch.setattr(rag_processor, "_reembed", reembed_with_concurrent_writes)
+
+    assert rag_processor.migrate_embeddings("other-model")
+
+    live_ids = sorted(set(ids) - {"chunk-0", "chunk-5"} | {"late"})
+    new_store = rag_processor.get_vector_store()
+    result = new_store._collection.get(include=["documents", "embeddings"])
+    assert sorted(result["ids"]) == live_ids
+    expected = TaggedEmbeddings(MODEL_TAGS["other-model"])
+    for document, embedding in zip(result["documents"], result["embeddings"]):
+        assert [float(x) for x in embedding] == expected.embed_query(document)
+
+    manifest = rag_processor.get_manifest()
+    assert rag_processor.get_active_embedding_model() == "other-model"
+    assert manifest.get_setting("active_collection") == new_store._collection.name
+    assert manifest.get_setting("migration_collection") == ""
+    assert rag_processor._migration_stop.waits == []  # unthrottled
+    status = rag_processor.get_embedding_status()["migration"]
+    assert status["state"] == "completed"
+    assert status["migrated"] == len(live_ids)
+    assert status["reconciled_removed"] == 1  # chunk-0, copied before the delete
+
+    # The old collection is retired, not dropped, so in-flight queries finish
+    assert store._collection.get(ids=["chunk-1"])["ids"] == ["chunk-1"]
+    retired = [entry["name"] for entry in rag_processor._get_retired_collections()]
+    assert retired == [old_name]
+
+
+def test_migration_copy_is_throttled(isolated_store, monkeypatch):
+    monkeypatch.setattr(rag_processor, "MIGRATION_BATCH_SIZE", 4)
+    monkeypatch.setattr(rag_processor, "MIGRATION_MAX_CHUNKS_PER_SECOND", 8)
+    monkeypatch.setattr(rag_processor, "_migration_stop", RecordingEvent())
+    add_chunks(rag_processor.get_vector_store(), 10)
+
+    assert rag_processor.migrate_embeddings("other-model")
+
+    # One wait per copied batch, topping each batch up to 4 / 8 = 0.5 seconds
+    waits = rag_processor._migration_stop.waits
+    assert len(waits) == 3
+    assert all(0 < wait <= 0.5 for wait in waits)
+
+
+def test_stopped_migration_keeps_old_collection(isolated_store, monkeypatch):
+    stop = threading.Event()
+    stop.set()
+    monkeypatch.setattr(rag_processor, "_migration_stop", stop)
+    store = rag_processor.get_vector_store()
+    add_chunks(store, 3)
+    old_name = store._collection.name
+
+    assert not rag_processor.migrate_embeddings("other-model")
+
+    manifest = rag_processor.get_manifest()
+    assert rag_processor.get_embedding_status()["migration"]["state"] == "failed"
+    assert rag_processor.get_active_embedding_model() == (
+        rag_processor.DEFAULT_EMBEDDING_MODEL_NAME
+    )
+    assert rag_processor.get_vector_store()._collection.name == old_name
+    assert manifest.get_setting("migration_collection") == ""
+    assert store._client.list_collections() == [old_name]
+
+
+def test_migration_removes_leftover_shadow_collection(isolated_store, monkeypatch):
+    """A shadow collection from an interrupted migration is dropped on restart."""
+    monkeypatch.setattr(rag_processor, "MIGRATION_MAX_CHUNKS_PER_SECOND", 0)
+    monkeypatch.setattr(rag_processor, "_migration_stop", threading.Event())
+    store = rag_processor.get_vector_store()
+    add_chunks(store, 3)
+    rag_processor._open_collection("interrupted_shadow", "other-model")
+    rag_processor.get_manifest().set_setting(
+        "migration_collection", "interrupted_shadow"
+    )
+
+    assert rag_processor.migrate_embeddings("other-model")
+
+    assert "interrupted_shadow" not in store._client.list_collections()
+
+
+def test_migration_after_compaction_in_the_same_second(isolated_store, monkeypatch):
+    """A shadow collection is never the live one, even with the clock pinned."""
+    monkeypatch.setattr(rag_processor.time, "time", lambda: 1700000000.0)
+    stop = threading.Event()
+    stop.set()
+    monkeypatch.setattr(rag_processor, "_migration_stop", stop)
+    add_chunks(rag_processor.get_vector_store(), 3)
+    rag_processor.compact_vector_store()
+    live = rag_processor.get_vector_store()._collection
+
+    # A stopped migration drops its shadow, which must not be the live index
+    assert not rag_processor.migrate_embeddings("other-model")
+
+    active = rag_processor.get_vector_store()._collection
+    assert active.name == live.name
+    assert sorted(active.get(include=[])["ids"]) == ["chunk-0", "chunk-1", "chunk-2"]
+    assert not rag_processor._drop_unused_collection(live.name)
+    assert live.name in rag_processor.get_vector_store()._client.list_collections()